@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# MODULE:     bench_tin_to_rast
+#
+# AUTHOR(S):  Alexander Muriy
+#             amuriy(at)gmail.com
+#
+# PURPOSE:    Benchmark of TIN rasterization: per-cell Vect_tin_get_z()
+#             against triangle-driven <v.tin.to.rast> on synthetic TINs
+#             and regions of several resolutions. Wall time, peak RSS and
+#             max absolute z difference are written to a JSON report.
+#             The triangle-driven path is timed reading the TIN from
+#             topology and from the <v.triangle> cache.
+#
+# COPYRIGHT:  (C) 2026 Alexander Muriy, and the GRASS Development Team
+#
+#             This program is free software under the GNU General
+#             Public License (>=v2). Read the file COPYING that
+#             comes with GRASS for details.
+#
+############################################################################
+
+#%module
+#% description: Benchmarks per-cell and triangle-driven TIN rasterization
+#% keywords: TIN
+#% keywords: benchmark
+#%end
+#%option
+#% key: triangles
+#% type: integer
+#% description: Approximate numbers of triangles of synthetic TINs
+#% answer: 1000,10000,100000,1000000,10000000
+#% multiple: yes
+#% required: no
+#%end
+#%option
+#% key: cells
+#% type: integer
+#% description: Numbers of raster cells along each side of the region
+#% answer: 100,1000,4000
+#% multiple: yes
+#% required: no
+#%end
+#%option
+#% key: maxcells
+#% type: integer
+#% description: Skip the per-cell path for regions with more cells
+#% answer: 1000000
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of processes for <v.tin.to.rast>
+#% answer: 1
+#% required: no
+#%end
+#%option G_OPT_F_OUTPUT
+#% key: report
+#% description: Name for output JSON report
+#%end
+#%flag
+#% key: k
+#% description: Keep synthetic TINs and rasters
+#%end
+############################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+# The per-cell path is the Vect_tin_get_z() loop of the original module
+# (evaluated at cell centres); it runs in a child process started with
+# --per-cell, so that every path is measured in its own process. Peak
+# RSS is the maximum resident set size of that process (os.wait4);
+# workers of nprocs > 1 are not included.
+#
+# <v.tin.to.rast> reads TINs not built by <v.triangle> from topology,
+# area by area; its first run on every region is done so, then the
+# map is linked to a cache entry of the TIN (as by <v.triangle>) for a
+# second, cached run.
+#
+############################################################################
+
+import sys
+import os
+import json
+import time
+import subprocess
+import shutil
+import atexit
+
+import numpy as np
+
+import grass.script as grass
+
+from tinarrays import (write_ascii, element_neighbours, arrays_key,
+                       save_cache, link_map, cache_dir)
+
+# extent of the synthetic TINs (map units)
+SIZE = 1000.0
+
+
+def synthetic_tin(ntri, seed = 0):
+    """Jittered grid of about <ntri> counterclockwise triangles with a
+    smooth surface; the hull is the square [0, SIZE] x [0, SIZE]."""
+    n = max(2, int(round(np.sqrt(ntri / 2.0))) + 1)
+    step = SIZE / (n - 1)
+    rng = np.random.RandomState(seed)
+    x, y = np.meshgrid(np.arange(n) * step, np.arange(n) * step)
+    jitter = rng.uniform(-0.25, 0.25, (2, n, n)) * step
+    inner = np.zeros((n, n), dtype = bool)
+    inner[1:-1, 1:-1] = True
+    x = np.where(inner, x + jitter[0], x).ravel()
+    y = np.where(inner, y + jitter[1], y).ravel()
+    z = 100 + 20 * np.sin(x / 150.0) * np.cos(y / 200.0) + 0.01 * x
+    nodes = np.c_[x, y, z]
+
+    i, j = np.meshgrid(np.arange(n - 1), np.arange(n - 1))
+    a = (j * n + i).ravel()
+    b = a + 1
+    c = a + n + 1
+    d = a + n
+    ele = np.concatenate([np.c_[a, b, c], np.c_[a, c, d]])
+    return nodes, ele
+
+
+def import_tin(nodes, ele, name):
+    """TIN vector map like the ones made by <v.triangle>."""
+    path = grass.tempfile()
+    write_ascii(nodes, ele, path)
+    raw = name + '_raw'
+    clean = name + '_clean'
+    grass.run_command('v.in.ascii', flags = 'zn', input_ = path, output = raw,
+                      format_ = 'standard', sep = ' ', quiet = True, stderr = nuldev)
+    grass.run_command('v.clean', input_ = raw, output = clean,
+                      tool = ('bpol', 'rmdupl'), quiet = True, stderr = nuldev)
+    grass.run_command('v.centroids', input_ = clean, output = name,
+                      quiet = True, stderr = nuldev)
+    grass.run_command('g.remove', flags = 'f', type_ = 'vector', name = (raw, clean),
+                      quiet = True, stderr = nuldev)
+    grass.try_remove(path)
+
+
+def seed_cache(nodes, ele):
+    """Cache entry of a TIN like the ones saved by <v.triangle>."""
+    key = arrays_key(nodes, ele)
+    save_cache(key, nodes, ele, element_neighbours(ele))
+    return key
+
+
+def unlink_map(name):
+    grass.try_remove(os.path.join(cache_dir(), 'maps', name))
+
+
+def measure(cmd):
+    """Wall time (s), peak RSS (kB) and exit status of a child process."""
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout = nuldev, stderr = nuldev)
+    pid, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return time.time() - start, usage.ru_maxrss, proc.returncode
+
+
+def max_abs_diff(map1, map2):
+    diff = 'bench_tin_diff_%d' % os.getpid()
+    grass.mapcalc("$diff = abs($a - $b)", diff = diff, a = map1, b = map2,
+                  quiet = True)
+    stats = grass.parse_command('r.univar', flags = 'g', map_ = diff)
+    grass.run_command('g.remove', flags = 'f', type_ = 'raster', name = diff,
+                      quiet = True, stderr = nuldev)
+    if not int(stats.get('n', 0)):
+        return None
+    return float(stats['max'])
+
+
+def per_cell(tin, output):
+    """Original per-cell rasterization, run with --per-cell."""
+    from ctypes import pointer, byref, c_double, POINTER
+    from grass.lib.gis import G_gisinit, G_find_vector2, Cell_head, G_get_window
+    from grass.lib.vector import Map_info, Vect_set_open_level, Vect_open_old, \
+        Vect_tin_get_z, Vect_close
+    from grass.lib.raster import Rast_open_new, Rast_put_d_row, Rast_close, \
+        DCELL_TYPE, DCELL
+
+    G_gisinit('')
+    map_info = pointer(Map_info())
+    Vect_set_open_level(2)
+    Vect_open_old(map_info, tin, G_find_vector2(tin, ""))
+    window = pointer(Cell_head())
+    G_get_window(window)
+    w = window.contents
+    outfd = Rast_open_new(output, DCELL_TYPE)
+    row = np.empty(w.cols)
+    z = c_double()
+    for i in range(w.rows):
+        y = w.north - (i + 0.5) * w.ns_res
+        for j in range(w.cols):
+            x = w.west + (j + 0.5) * w.ew_res
+            if Vect_tin_get_z(map_info, x, y, byref(z), None, None) == 1:
+                row[j] = z.value
+            else:
+                row[j] = np.nan
+        Rast_put_d_row(outfd, row.ctypes.data_as(POINTER(DCELL)))
+    Rast_close(outfd)
+    Vect_close(map_info)
+    return 0
+
+
+def cleanup():
+    if flags['k']:
+        return
+    for name in vects:
+        unlink_map(name)
+    for key in keys:
+        shutil.rmtree(os.path.join(cache_dir(), key), ignore_errors = True)
+    for kind, names in (('raster', rasts), ('vector', vects)):
+        if names:
+            grass.run_command('g.remove', flags = 'f', type_ = kind,
+                              name = ','.join(names), quiet = True, stderr = nuldev)
+
+
+def main():
+    global nuldev, rasts, vects, keys
+    nuldev = open(os.devnull, 'w')
+    rasts = []
+    vects = []
+    keys = []
+
+    sizes = [int(v) for v in options['triangles'].split(',')]
+    cells = [int(v) for v in options['cells'].split(',')]
+    maxcells = int(options['maxcells'])
+    nprocs = int(options['nprocs'])
+    here = os.path.dirname(os.path.abspath(__file__))
+    module = os.path.join(here, 'v.tin.to.rast_G70.py')
+    pid = os.getpid()
+
+    grass.use_temp_region()
+    report = dict(grass_version = grass.version().get('version'),
+                  nprocs = nprocs, maxcells = maxcells, runs = [])
+
+    for ntri in sizes:
+        grass.message(_("Synthetic TIN of about %d triangles...") % ntri)
+        nodes, ele = synthetic_tin(ntri)
+        tin = 'bench_tin_%d_%d' % (len(ele), pid)
+        start = time.time()
+        import_tin(nodes, ele, tin)
+        vects.append(tin)
+        import_time = time.time() - start
+        start = time.time()
+        key = seed_cache(nodes, ele)
+        keys.append(key)
+        seed_time = time.time() - start
+
+        for ncells in cells:
+            grass.run_command('g.region', n = SIZE, s = 0, e = SIZE, w = 0,
+                              rows = ncells, cols = ncells, quiet = True)
+            run = dict(triangles = int(len(ele)), nodes = int(len(nodes)),
+                       rows = ncells, cols = ncells, import_seconds = import_time,
+                       seed_seconds = seed_time)
+
+            fast = 'bench_tri_%d_%d_%d' % (len(ele), ncells, pid)
+            rasts.append(fast)
+            cmd = [sys.executable, module, 'input=%s' % tin, 'output=%s' % fast,
+                   'nprocs=%d' % nprocs, '--overwrite', '--quiet']
+            grass.message(_("  %d x %d cells: triangle-driven (topology)...") % (ncells, ncells))
+            unlink_map(tin)
+            sec, rss, status = measure(cmd)
+            run['triangle'] = dict(seconds = sec, peak_rss_kb = rss, status = status,
+                                   cached = False)
+
+            grass.message(_("  %d x %d cells: triangle-driven (cached)...") % (ncells, ncells))
+            link_map(tin, key)
+            sec, rss, status = measure(cmd)
+            run['triangle_cached'] = dict(seconds = sec, peak_rss_kb = rss, status = status,
+                                          cached = True)
+            unlink_map(tin)
+
+            if ncells * ncells > maxcells:
+                run['per_cell'] = None
+            else:
+                slow = 'bench_cell_%d_%d_%d' % (len(ele), ncells, pid)
+                rasts.append(slow)
+                grass.message(_("  %d x %d cells: per-cell...") % (ncells, ncells))
+                sec, rss, status = measure([sys.executable, os.path.abspath(__file__),
+                                            '--per-cell', tin, slow])
+                run['per_cell'] = dict(seconds = sec, peak_rss_kb = rss, status = status)
+                if status == 0 and run['triangle_cached']['status'] == 0:
+                    run['max_abs_diff'] = max_abs_diff(fast, slow)
+            report['runs'].append(run)
+
+            with open(options['report'], 'w') as fout:
+                json.dump(report, fout, indent = 2)
+
+    grass.message(_("Report written to <%s>") % options['report'])
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == '--per-cell':
+        sys.exit(per_cell(sys.argv[2], sys.argv[3]))
+    options, flags = grass.parser()
+    atexit.register(cleanup)
+    sys.exit(main())
@@ -0,0 +1,67 @@
+############################################################################
+#
+# Masspoints preprocessing for <v.triangle>: removal of exact and
+# near-duplicate XY points and thinning to a target density.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import numpy as np
+
+
+def grid_cells(xy, cell):
+    """Snap XY coordinates to a grid with the given cell size.
+
+    Returns integer column and row indices of every point, counted from
+    the lower left corner of the points extent.
+    """
+    origin = xy.min(axis=0)
+    ij = np.floor((xy - origin) / cell).astype(np.int64)
+    return ij[:, 0], ij[:, 1]
+
+
+def reduce_cells(xyz, cell, method='mean'):
+    """Keep one point per grid cell.
+
+    <method> chooses the kept point: 'min' and 'max' keep the point with
+    the lowest or highest z in the cell, 'mean' replaces all points of
+    the cell with their mean x, y and z.
+    """
+    if len(xyz) == 0:
+        return xyz
+    col, row = grid_cells(xyz[:, :2], cell)
+    # sort by cell, then by z inside the cell
+    order = np.lexsort((xyz[:, 2], row, col))
+    col = col[order]
+    row = row[order]
+    first = np.r_[True, (col[1:] != col[:-1]) | (row[1:] != row[:-1])]
+    start = np.flatnonzero(first)
+    if method == 'min':
+        return xyz[order[start]]
+    if method == 'max':
+        end = np.r_[start[1:], len(order)] - 1
+        return xyz[order[end]]
+    counts = np.diff(np.r_[start, len(order)])
+    sums = np.add.reduceat(xyz[order], start, axis=0)
+    return sums / counts[:, None]
+
+
+def thin_points(xyz, tolerance=None, density=None, method='mean'):
+    """Remove duplicate points and optionally thin them to a density.
+
+    Points closer than <tolerance> (falling into the same snapping cell)
+    are merged according to <method>. With <density> (points per square
+    map unit) the result is thinned once more on a grid of 1/density
+    cell area. Returns the new points together with the number of
+    points removed as duplicates and by thinning.
+    """
+    nin = len(xyz)
+    if tolerance:
+        xyz = reduce_cells(xyz, tolerance, method)
+    ndup = nin - len(xyz)
+    nsnap = len(xyz)
+    if density:
+        xyz = reduce_cells(xyz, 1.0 / np.sqrt(density), method)
+    nthin = nsnap - len(xyz)
+    return xyz, ndup, nthin
@@ -0,0 +1,123 @@
+############################################################################
+#
+# Moving maximum filter for <r.localmax> by the van Herk/Gil-Werman
+# algorithm: the array is cut into blocks of the window size and every
+# window is the maximum of the suffix maximum of one block and the prefix
+# maximum of the next one, i.e. 3 comparisons per cell for any window.
+# The square filter is separable (rows, then columns).
+#
+# Like r.mapcalc max(), a window with a null (NaN) cell or reaching out
+# of the region gives null.
+#
+# The streaming versions take the raster row by row and keep about
+# 2 * size rows, so rasters larger than memory can be filtered.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+from itertools import tee
+
+import numpy as np
+
+
+def running_max(a, size, axis = -1):
+    """Maximum over centred windows of odd <size> along <axis>."""
+    a = np.moveaxis(np.asarray(a, dtype = float), axis, -1)
+    half = size // 2
+    n = a.shape[-1]
+    nblocks = -(-(n + 2 * half) // size)
+    pad = np.full(a.shape[:-1] + (nblocks * size,), np.nan)
+    pad[..., half:half + n] = a
+
+    # np.maximum propagates NaN, so do the accumulated maxima
+    blocks = pad.reshape(a.shape[:-1] + (nblocks, size))
+    prefix = np.maximum.accumulate(blocks, axis = -1).reshape(pad.shape)
+    suffix = np.maximum.accumulate(blocks[..., ::-1], axis = -1)[..., ::-1].reshape(pad.shape)
+    out = np.maximum(suffix[..., :n], prefix[..., size - 1:size - 1 + n])
+    return np.moveaxis(out, -1, axis)
+
+
+def window_max(a, size):
+    """Maximum over the <size> x <size> window around every cell."""
+    return running_max(running_max(a, size, axis = 1), size, axis = 0)
+
+
+def local_max(a, size):
+    """Cells equal to the maximum of their window, NaN elsewhere."""
+    return np.where(a == window_max(a, size), a, np.nan)
+
+
+def stream_window_max(rows, nrows, ncols, size):
+    """Rows of window_max() for an iterator of <nrows> raster rows,
+    yielded as soon as their window is complete."""
+    half = size // 2
+    null = np.full(ncols, np.nan)
+
+    def padded():
+        for k in range(half):
+            yield null
+        for row in rows:
+            yield running_max(row, size)
+        while True:
+            yield null
+
+    # vertical pass over blocks of <size> rows: suffix maxima of the last
+    # complete block and the running prefix maximum of the current one
+    # give the window starting at every row of the last block
+    suffix = None
+    block = []
+    nout = 0
+    for k, row in enumerate(padded()):
+        if nout == nrows:
+            return
+        t = k % size
+        prefix = row if t == 0 else np.maximum(prefix, row)
+        block.append(row)
+        if t == size - 1:
+            suffix = np.maximum.accumulate(np.array(block[::-1]), axis = 0)[::-1]
+            block = []
+            yield suffix[0]
+            nout += 1
+        elif suffix is not None:
+            yield np.maximum(suffix[t + 1], prefix)
+            nout += 1
+
+
+def stream_local_max(rows, nrows, ncols, size):
+    """Rows of local_max() for an iterator of <nrows> raster rows."""
+    # the input rows are kept until the maximum of their window is ready
+    raw, work = tee(rows)
+    for row, wmax in zip(raw, stream_window_max(work, nrows, ncols, size)):
+        yield np.where(row == wmax, row, np.nan)
+
+
+def _shift_max(m, d, axis):
+    # max(m[i - d], m[i + d]) along <axis>, NaN beyond the border
+    m = np.moveaxis(m, axis, -1)
+    lo = np.full(m.shape, np.nan)
+    hi = np.full(m.shape, np.nan)
+    lo[..., d:] = m[..., :-d]
+    hi[..., :-d] = m[..., d:]
+    return np.moveaxis(np.maximum(lo, hi), -1, axis)
+
+
+def multiscale_window_max(a, sizes):
+    """window_max() for ascending odd <sizes>, as (size, maxima) pairs.
+
+    A window of size b is the union of 4 windows of size a shifted by
+    d = (b - a) / 2 if 2 * d <= a, so larger scales are composed from
+    smaller ones (with intermediate scales where the step is too big).
+    """
+    wmax = None
+    cur = 0
+    for size in sizes:
+        if wmax is None or cur < 3:
+            wmax = window_max(a, size)
+            cur = size
+        while cur < size:
+            nxt = min(size, 2 * cur - 1)
+            d = (nxt - cur) // 2
+            wmax = _shift_max(_shift_max(wmax, d, 1), d, 0)
+            cur = nxt
+        yield size, wmax
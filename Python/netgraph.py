@@ -0,0 +1,269 @@
+############################################################################
+#
+# Network of a vector map as NumPy arrays for <v.net.neighbors>: node
+# points (layer 2 categories) and the end points of lines, read in one
+# pass over the features. Points are snapped to line ends within a
+# tolerance through a uniform grid hash, and neighbour lists of all
+# points are CSR arrays (neighbours of point i are
+# indices[indptr[i]:indptr[i + 1]]).
+# Neighbourhoods of k hops (frontier expansion for all points at once)
+# or of a bounded network distance (Dijkstra) are CSR arrays as well.
+#
+# For incremental runs the points whose neighbours may have changed are
+# found from the points and line hashes of the previous run.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import heapq
+import hashlib
+
+import numpy as np
+
+import grass.script as grass
+
+from ctypes import pointer, byref, c_int
+from grass.lib.gis import G_find_vector2
+from grass.lib.vector import (Map_info, Vect_set_open_level, Vect_open_old,
+                              Vect_close, Vect_get_num_lines, Vect_line_alive,
+                              Vect_read_line, Vect_cat_get, Vect_line_length,
+                              Vect_new_line_struct, Vect_destroy_line_struct,
+                              Vect_new_cats_struct, Vect_destroy_cats_struct,
+                              GV_POINT)
+
+
+class Network(object):
+    """Node points and lines of a network vector map.
+
+    points: cat (layer 2), x and y of every point; lines: id, cat
+    (layer 1, -1 if none), start and end point (L, 2, 2), length and
+    hash of the category and geometry of every line of <vtype>. End e
+    of all lines is line e // 2.
+    """
+
+    def __init__(self, point_cat, point_xy, line_id, line_cat, line_ends,
+                 line_length, line_hash):
+        self.point_cat = point_cat
+        self.point_xy = point_xy
+        self.line_id = line_id
+        self.line_cat = line_cat
+        self.line_ends = line_ends
+        self.line_length = line_length
+        self.line_hash = line_hash
+
+
+def geometry_hash(cat, x, y):
+    sha = hashlib.sha1(str(cat).encode('utf-8'))
+    sha.update(x.tobytes())
+    sha.update(y.tobytes())
+    return int(np.frombuffer(sha.digest()[:8], dtype = np.int64)[0])
+
+
+def read_network(mapname, vtype):
+    """Read a network map in one pass over its features.
+
+    G_gisinit() must be called before.
+    """
+    mapset = G_find_vector2(mapname, "")
+    if not mapset:
+        grass.fatal(_("Vector map <%s> not found") % mapname)
+
+    map_info = pointer(Map_info())
+    Vect_set_open_level(2)
+    Vect_open_old(map_info, mapname, mapset)
+
+    points = Vect_new_line_struct()
+    cats = Vect_new_cats_struct()
+    cat = c_int()
+    pcat, pxy = [], []
+    lid, lcat, lends, llen, lhash = [], [], [], [], []
+    for line in range(1, Vect_get_num_lines(map_info) + 1):
+        if not Vect_line_alive(map_info, line):
+            continue
+        ltype = Vect_read_line(map_info, points, cats, line)
+        p = points.contents
+        if ltype == GV_POINT:
+            if not Vect_cat_get(cats, 2, byref(cat)):
+                continue
+            pcat.append(cat.value)
+            pxy.append((p.x[0], p.y[0]))
+        elif ltype == vtype:
+            last = p.n_points - 1
+            lid.append(line)
+            lcat.append(cat.value if Vect_cat_get(cats, 1, byref(cat)) else -1)
+            lends.append(((p.x[0], p.y[0]), (p.x[last], p.y[last])))
+            llen.append(Vect_line_length(points))
+            lhash.append(geometry_hash(lcat[-1],
+                                       np.ctypeslib.as_array(p.x, (p.n_points,)),
+                                       np.ctypeslib.as_array(p.y, (p.n_points,))))
+    Vect_destroy_cats_struct(cats)
+    Vect_destroy_line_struct(points)
+    Vect_close(map_info)
+
+    return Network(np.array(pcat, dtype = np.int64),
+                   np.array(pxy, dtype = float).reshape(-1, 2),
+                   np.array(lid, dtype = np.int64),
+                   np.array(lcat, dtype = np.int64),
+                   np.array(lends, dtype = float).reshape(-1, 2, 2),
+                   np.array(llen, dtype = float),
+                   np.array(lhash, dtype = np.int64))
+
+
+def match(a, b):
+    """All index pairs (i, j) with a[i] == b[j]."""
+    order = np.argsort(b, kind = 'stable')
+    sb = b[order]
+    lo = np.searchsorted(sb, a, 'left')
+    hi = np.searchsorted(sb, a, 'right')
+    count = hi - lo
+    i = np.repeat(np.arange(len(a)), count)
+    start = np.repeat(lo - np.cumsum(count) + count, count)
+    j = order[start + np.arange(count.sum())]
+    return i, j
+
+
+def snap_ends(point_xy, line_ends, snap = 0):
+    """(point, end) index pairs of points within <snap> of line ends
+    (at the same coordinates if snap is 0)."""
+    ends = line_ends.reshape(-1, 2)
+    if snap <= 0:
+        xy = np.concatenate([point_xy, ends])
+        ids = np.unique(xy, axis = 0, return_inverse = True)[1].ravel()
+        return match(ids[:len(point_xy)], ids[len(point_xy):])
+
+    # uniform grid of cells of <snap>: end points within <snap> of a point
+    # are in the 3 x 3 cells around it
+    cp = np.floor(point_xy / snap).astype(np.int64)
+    ce = np.floor(ends / snap).astype(np.int64)
+    lo = np.minimum(cp.min(axis = 0, initial = 0), ce.min(axis = 0, initial = 0)) - 1
+    width = max(cp[:, 0].max(initial = 0), ce[:, 0].max(initial = 0)) - lo[0] + 2
+    ekey = (ce[:, 1] - lo[1]) * width + (ce[:, 0] - lo[0])
+    pts, eds = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            pkey = (cp[:, 1] + dy - lo[1]) * width + (cp[:, 0] + dx - lo[0])
+            i, j = match(pkey, ekey)
+            near = ((point_xy[i] - ends[j]) ** 2).sum(axis = 1) <= snap ** 2
+            pts.append(i[near])
+            eds.append(j[near])
+    return np.concatenate(pts), np.concatenate(eds)
+
+
+def to_csr(rows, cols, nrows, weight = None):
+    """CSR arrays of unique (row, col) pairs, columns sorted per row, and
+    the index of the pair kept for every entry (the one of least
+    <weight> if given)."""
+    ncols = int(cols.max()) + 1 if len(cols) else 1
+    key = rows * ncols + cols
+    order = np.lexsort((weight, key)) if weight is not None else np.argsort(key, kind = 'stable')
+    first = order[np.r_[True, key[order][1:] != key[order][:-1]]] if len(key) else order
+    indptr = np.searchsorted(rows[first], np.arange(nrows + 1))
+    return indptr, cols[first], first
+
+
+def point_neighbours(pt, end, npoints, line_length = None):
+    """Neighbours of every point (all points sharing a line with it, but
+    itself) from (point, end) incidence pairs, as CSR arrays of point
+    indices, with the line of every neighbour (the shortest one if
+    <line_length> is given) and whether both are on the same line end."""
+    i, j = match(end // 2, end // 2)
+    a, b, line = pt[i], pt[j], end[i] // 2
+    same = end[i] == end[j]
+    keep = a != b
+    a, b, line, same = a[keep], b[keep], line[keep], same[keep]
+    weight = np.where(same, 0.0, line_length[line]) if line_length is not None else None
+    indptr, indices, first = to_csr(a, b, npoints, weight)
+    return indptr, indices, line[first], same[first]
+
+
+def csr_from_pairs(rows, cols, values, nrows):
+    """CSR arrays of (row, col) pairs, columns sorted per row, with the
+    values of the pairs in the same order."""
+    order = np.lexsort((cols, rows))
+    indptr = np.searchsorted(rows[order], np.arange(nrows + 1))
+    return indptr, cols[order], values[order]
+
+
+def hop_neighbourhood(indptr, indices, hops):
+    """Points within <hops> hops of every point (itself excluded) as CSR
+    arrays, with the number of hops to every one."""
+    n = len(indptr) - 1
+    src = np.arange(n)
+    node = np.arange(n)
+    seen = src * n + node
+    rows, cols, dist = [], [], []
+    for hop in range(1, hops + 1):
+        # all neighbours of the frontier, for all sources at once
+        start = indptr[node]
+        deg = indptr[node + 1] - start
+        pos = np.repeat(start - np.cumsum(deg) + deg, deg) + np.arange(deg.sum())
+        key = np.unique(np.repeat(src, deg) * n + indices[pos])
+        key = key[~np.isin(key, seen, assume_unique = True)]
+        if not len(key):
+            break
+        seen = np.union1d(seen, key)
+        src, node = key // n, key % n
+        rows.append(src)
+        cols.append(node)
+        dist.append(np.full(len(key), hop))
+    if not rows:
+        return np.zeros(n + 1, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0)
+    return csr_from_pairs(np.concatenate(rows), np.concatenate(cols),
+                           np.concatenate(dist).astype(float), n)
+
+
+def cost_neighbourhood(indptr, indices, weights, max_cost):
+    """Points within network distance <max_cost> of every point (itself
+    excluded) as CSR arrays, with the distance to every one."""
+    n = len(indptr) - 1
+    ptr = indptr.tolist()
+    nbr = indices.tolist()
+    wgt = weights.tolist()
+    rows, cols, dist = [], [], []
+    for s in range(n):
+        best = {s: 0.0}
+        heap = [(0.0, s)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > best[u]:
+                continue
+            for k in range(ptr[u], ptr[u + 1]):
+                v = nbr[k]
+                nd = d + wgt[k]
+                if nd <= max_cost and nd < best.get(v, np.inf):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        del best[s]
+        rows.extend([s] * len(best))
+        cols.extend(best.keys())
+        dist.extend(best.values())
+    return csr_from_pairs(np.array(rows, dtype = np.int64), np.array(cols, dtype = np.int64),
+                           np.array(dist, dtype = float), n)
+
+
+def affected_points(old, cats, xy, line_hash, inc_cat, inc_hash):
+    """Categories of points whose neighbours may differ from those of the
+    previous run <old> (a dict of its arrays, see <v.net.neighbors>):
+    added, removed and moved points with their old and new neighbours,
+    and points on added, removed or changed lines.
+
+    inc_cat and inc_hash are the point category and line hash of every
+    (point, line end) incidence pair of this run.
+    """
+    old_cats = old['point_cat']
+    common, i, j = np.intersect1d(cats, old_cats, return_indices = True)
+    moved = common[(xy[i] != old['point_xy'][j]).any(axis = 1)]
+    changed = np.union1d(np.setxor1d(cats, old_cats), moved)
+
+    # old neighbours of changed points
+    old_rows = np.repeat(old_cats, np.diff(old['adj_indptr']))
+    old_nbrs = old['adj_cats'][np.isin(old_rows, changed)]
+    # new neighbours of changed points: points on their lines
+    new_nbrs = inc_cat[np.isin(inc_hash, inc_hash[np.isin(inc_cat, changed)])]
+
+    # points on lines which are in one run only
+    lines = np.setxor1d(line_hash, old['line_hash'])
+    on_lines = np.concatenate([inc_cat[np.isin(inc_hash, lines)],
+                               old['inc_cat'][np.isin(old['inc_hash'], lines)]])
+    return np.unique(np.concatenate([changed, old_nbrs, new_nbrs, on_lines]))
@@ -0,0 +1,235 @@
+############################################################################
+#
+# Peaks of <r.localmax> from sparse candidate cells (row, col, value):
+# flat-topped maxima are 8-connected cells of equal value, labelled by
+# a vectorized union-find over sorted cell keys. Peaks closer than a
+# minimum distance to a higher one can be suppressed. select_peaks()
+# gives the points and attributes written by <r.localmax>.
+#
+# Topographic prominence is computed by the sweep over all cells from
+# the highest one, merging 8-connected components with union-find: when
+# a cell joins components, it is the key col of all their peaks but the
+# highest one.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import heapq
+
+import numpy as np
+
+# forward half of the 8-neighbourhood (the other half is symmetric)
+OFFSETS = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+# peak memory of prominence() per raster cell (bytes), the raster included
+PROMINENCE_CELL_BYTES = 80
+
+
+def find_cells(keys, query):
+    """Index of every query key in sorted <keys>, -1 if not present."""
+    idx = np.searchsorted(keys, query)
+    idx = np.minimum(idx, len(keys) - 1)
+    return np.where(keys[idx] == query, idx, -1)
+
+
+def find_roots(parent):
+    # pointer jumping until every cell points to its root
+    while True:
+        up = parent[parent]
+        if np.array_equal(up, parent):
+            return parent
+        parent = up
+
+
+def union(parent, a, b):
+    """Merge the sets of cell pairs (a[k], b[k]); roots are minimal cells."""
+    while len(a):
+        ra = find_roots(parent)[a]
+        rb = find_roots(parent)[b]
+        diff = ra != rb
+        if not diff.any():
+            break
+        lo = np.minimum(ra, rb)[diff]
+        hi = np.maximum(ra, rb)[diff]
+        np.minimum.at(parent, hi, lo)
+        a = a[diff]
+        b = b[diff]
+    return find_roots(parent)
+
+
+def label_plateaus(rows, cols, values, ncols):
+    """Label of every candidate cell: 8-connected cells of equal value
+    get the same label, labels are 0 .. nlabels - 1."""
+    n = len(rows)
+    if not n:
+        return np.zeros(0, dtype = np.int64)
+    keys = rows.astype(np.int64) * (ncols + 2) + (cols + 1)
+    order = np.argsort(keys, kind = 'stable')
+    skeys = keys[order]
+    parent = np.arange(n)
+    pairs_a, pairs_b = [], []
+    for dr, dc in OFFSETS:
+        nb = find_cells(skeys, skeys + dr * (ncols + 2) + dc)
+        ok = nb >= 0
+        ok[ok] = values[order][ok] == values[order][nb[ok]]
+        pairs_a.append(np.flatnonzero(ok))
+        pairs_b.append(nb[ok])
+    roots = union(parent, np.concatenate(pairs_a), np.concatenate(pairs_b))
+    label = np.empty(n, dtype = np.int64)
+    label[order] = np.unique(roots, return_inverse = True)[1]
+    return label
+
+
+def plateau_peaks(rows, cols, values, ncols):
+    """One peak per plateau: mean row and col of its cells (cell units),
+    value, number of cells and the plateau label of every cell."""
+    label = label_plateaus(rows, cols, values, ncols)
+    nlabels = label.max() + 1 if len(label) else 0
+    cells = np.bincount(label, minlength = nlabels)
+    prow = np.bincount(label, rows, nlabels) / np.maximum(cells, 1)
+    pcol = np.bincount(label, cols, nlabels) / np.maximum(cells, 1)
+    value = np.zeros(nlabels)
+    value[label] = values
+    return prow, pcol, value, cells, label
+
+
+def suppress(x, y, value, min_distance = 0, top_k = 0):
+    """Indices of peaks accepted greedily from the highest one, skipping
+    peaks closer than <min_distance> to an accepted one; at most <top_k>
+    peaks if given."""
+    heap = [(-v, k) for k, v in enumerate(value)]
+    heapq.heapify(heap)
+    # accepted peaks hashed by grid cells of min_distance
+    grid = {}
+    accepted = []
+    while heap and (not top_k or len(accepted) < top_k):
+        v, k = heapq.heappop(heap)
+        if min_distance > 0:
+            gx = int(np.floor(x[k] / min_distance))
+            gy = int(np.floor(y[k] / min_distance))
+            near = False
+            for cell in ((gx + i, gy + j) for i in (-1, 0, 1) for j in (-1, 0, 1)):
+                for m in grid.get(cell, ()):
+                    if (x[m] - x[k]) ** 2 + (y[m] - y[k]) ** 2 < min_distance ** 2:
+                        near = True
+                        break
+                if near:
+                    break
+            if near:
+                continue
+            grid.setdefault((gx, gy), []).append(k)
+        accepted.append(k)
+    return np.array(accepted, dtype = np.int64)
+
+
+def prominence(arr):
+    """Prominence and key col elevation of every peak cell of a raster
+    (NaN elsewhere), and the peak cell of every cell when it was reached
+    by the sweep. The highest peak of every connected region of non-null
+    cells gets the drop to the lowest cell of the region and no col."""
+    nrows, ncols = arr.shape
+    n = nrows * ncols
+    z = np.ascontiguousarray(arr, dtype = float).ravel()
+    # cell indices fit in 32 bits up to 2^31 cells
+    itype = np.int32 if n < 2 ** 31 else np.int64
+    # NaN is sorted last
+    order = np.argsort(-z, kind = 'stable')[:np.count_nonzero(~np.isnan(z))].astype(itype)
+    rank = np.empty(n, dtype = itype)
+    rank[order] = np.arange(len(order), dtype = itype)
+    parent = np.full(n, -1, dtype = itype)
+    peak = np.full(n, -1, dtype = itype)
+    top = np.full(n, -1, dtype = np.int64)
+    prom = np.full(n, np.nan)
+    col = np.full(n, np.nan)
+
+    # the sweep is a Python loop: memoryviews index the arrays as fast as
+    # lists, without their per-item objects
+    zv, rankv, parentv, peakv = (memoryview(a) for a in (z, rank, parent, peak))
+    topv, promv, colv = (memoryview(a) for a in (top, prom, col))
+
+    def find(c):
+        while parentv[c] != c:
+            parentv[c] = parentv[parentv[c]]
+            c = parentv[c]
+        return c
+
+    for c in (c for k in range(0, len(order), 1 << 16)
+              for c in order[k:k + (1 << 16)].tolist()):
+        r, q = divmod(c, ncols)
+        roots = set()
+        for dr in (-1, 0, 1):
+            rr = r + dr
+            if rr < 0 or rr >= nrows:
+                continue
+            for dc in (-1, 0, 1):
+                qq = q + dc
+                if 0 <= qq < ncols and parentv[rr * ncols + qq] >= 0:
+                    roots.add(find(rr * ncols + qq))
+        if not roots:
+            parentv[c] = c
+            peakv[c] = c
+        else:
+            # the component of the highest (first reached) peak survives
+            best = min(roots, key = lambda t: rankv[peakv[t]])
+            for t in roots:
+                if t != best:
+                    p = peakv[t]
+                    peakv[t] = -1
+                    promv[p] = zv[p] - zv[c]
+                    colv[p] = zv[c]
+                    parentv[t] = best
+            parentv[c] = best
+        topv[c] = peakv[find(c)]
+
+    # remaining peaks: drop to the lowest cell of their region
+    roots = find_roots(np.where(parent >= 0, parent, np.arange(n, dtype = itype)))[order]
+    lowest = np.full(n, np.inf)
+    np.minimum.at(lowest, roots, z[order])
+    left = np.flatnonzero(peak >= 0)
+    prom[peak[left]] = z[peak[left]] - lowest[left]
+    return prom.reshape(arr.shape), col.reshape(arr.shape), top.reshape(arr.shape)
+
+
+def cell_prominence(arr, prom, col, top, rows, cols):
+    """Prominence and key col elevation of candidate cells: those of the
+    peak they were reached from if it is as high, else zero and their
+    own elevation (a path of cells as high leads to a higher peak)."""
+    z = arr[rows, cols]
+    t = top[rows, cols]
+    tr, tc = t // arr.shape[1], t % arr.shape[1]
+    same = arr[tr, tc] == z
+    return (np.where(same, prom[tr, tc], 0.0),
+            np.where(same, col[tr, tc], z))
+
+
+def select_peaks(rows, cols, values, ncols, west, north, ewres, nsres,
+                 min_distance = 0, top_k = 0, sweep = None, min_prominence = 0):
+    """Peak points of candidate cells: x, y and the attributes value,
+    cells, row and col of every point, with prominence and col_elev if
+    <sweep> (the raster and the result of prominence()) is given.
+
+    Flat-topped maxima (8-connected cells of equal value) are collapsed
+    to one point at their centroid.
+    """
+    prow, pcol, value, cells, label = plateau_peaks(rows, cols, values, ncols)
+    x = west + (pcol + 0.5) * ewres
+    y = north - (prow + 0.5) * nsres
+    attrs = [value, cells, np.round(prow), np.round(pcol)]
+
+    # prominence of a plateau is that of its most prominent cell
+    if sweep is not None:
+        cprom, ccol = cell_prominence(*(tuple(sweep) + (rows, cols)))
+        order = np.lexsort((-cprom, label))
+        first = order[np.r_[True, label[order][1:] != label[order][:-1]]]
+        attrs += [cprom[first], ccol[first]]
+        keep = np.flatnonzero(cprom[first] >= min_prominence)
+        x, y = x[keep], y[keep]
+        attrs = [a[keep] for a in attrs]
+
+    # highest peaks first, without peaks too close to a higher one
+    if min_distance > 0 or top_k > 0:
+        keep = suppress(x, y, attrs[0], min_distance, top_k)
+        x, y = x[keep], y[keep]
+        attrs = [a[keep] for a in attrs]
+    return x, y, attrs
@@ -0,0 +1,78 @@
+############################################################################
+#
+# Vectorized clipping of many convex polygons at once (Sutherland-Hodgman
+# with one half-plane per polygon), with areas and centroids.
+#
+# Polygons are stored in a (P, K, 2) array padded beyond the vertex
+# counts given in a (P,) array.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import numpy as np
+
+
+def _next_vertex(poly, count):
+    k = poly.shape[1]
+    idx = np.arange(k)[None, :]
+    nxt = np.where(idx + 1 < count[:, None], idx + 1, 0)
+    valid = idx < count[:, None]
+    return np.take_along_axis(poly, nxt[..., None], axis = 1), valid
+
+
+def clip_halfplane(poly, count, a, b, c):
+    """Clip convex polygons by half-planes a * x + b * y + c >= 0."""
+    if not len(poly):
+        return poly, count
+    npoly, k = poly.shape[:2]
+    v1, valid = _next_vertex(poly, count)
+    s0 = a[:, None] * poly[..., 0] + b[:, None] * poly[..., 1] + c[:, None]
+    s1 = a[:, None] * v1[..., 0] + b[:, None] * v1[..., 1] + c[:, None]
+    in0 = s0 >= 0
+    in1 = s1 >= 0
+    cross = valid & (in0 != in1)
+    denom = np.where(cross, s0 - s1, 1.0)
+    t = np.where(cross, s0 / denom, 0.0)
+    inter = poly + t[..., None] * (v1 - poly)
+
+    # every edge emits its start vertex (if inside) and its crossing point
+    cand = np.stack([poly, inter], axis = 2).reshape(npoly, 2 * k, 2)
+    emit = np.stack([valid & in0, cross], axis = 2).reshape(npoly, 2 * k)
+    newcount = emit.sum(axis = 1)
+    width = max(int(newcount.max()), 1)
+    order = np.argsort(~emit, axis = 1, kind = 'stable')[:, :width]
+    return np.take_along_axis(cand, order[..., None], axis = 1), newcount
+
+
+def clip_convex(poly, count, clip, clipcount):
+    """Intersect convex polygons with convex counterclockwise polygons."""
+    nxt, valid = _next_vertex(clip, clipcount)
+    for j in range(clip.shape[1]):
+        # padded edges of short clip polygons keep everything
+        on = valid[:, j]
+        p = clip[:, j]
+        q = nxt[:, j]
+        a = np.where(on, -(q[:, 1] - p[:, 1]), 0.0)
+        b = np.where(on, q[:, 0] - p[:, 0], 0.0)
+        c = np.where(on, -(a * p[:, 0] + b * p[:, 1]), 1.0)
+        poly, count = clip_halfplane(poly, count, a, b, c)
+    return poly, count
+
+
+def area_centroid(poly, count):
+    """Areas (counterclockwise positive) and centroids of polygons."""
+    v1, valid = _next_vertex(poly, count)
+    cr = np.where(valid, poly[..., 0] * v1[..., 1] - v1[..., 0] * poly[..., 1], 0.0)
+    area = cr.sum(axis = 1) / 2
+    safe = np.where(area != 0, area, 1.0)
+    cx = (cr * (poly[..., 0] + v1[..., 0])).sum(axis = 1) / (6 * safe)
+    cy = (cr * (poly[..., 1] + v1[..., 1])).sum(axis = 1) / (6 * safe)
+    # degenerate polygons: mean of vertices
+    n = np.maximum(count, 1)
+    mx = np.where(valid, poly[..., 0], 0).sum(axis = 1) / n
+    my = np.where(valid, poly[..., 1], 0).sum(axis = 1) / n
+    zero = area == 0
+    cx[zero] = mx[zero]
+    cy[zero] = my[zero]
+    return area, cx, cy
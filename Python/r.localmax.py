@@ -58,14 +58,69 @@
 #% key: msize
 #% type: integer
 #% required: yes
-#% description: Matrix size (odd number)
+#% multiple: yes
+#% description: Matrix size(s) (odd numbers); several sizes give output maps <output>_<size> (and <points>_<size>)
 #% answer: 11
 #%End
+#%Option
+#% key: min_distance
+#% type: double
+#% required: no
+#% description: Minimum distance between peak points (in map units)
+#%End
+#%Option
+#% key: top_k
+#% type: integer
+#% required: no
+#% description: Maximum number of peak points (the highest ones)
+#%End
+#%Option
+#%  key: prominence
+#%  type: string
+#%  required: no
+#%  key_desc: name
+#%  description: Name of output raster map with the prominence of peak cells
+#%  gisprompt: new,cell,raster
+#%End
+#%Option
+#% key: min_prominence
+#% type: double
+#% required: no
+#% description: Minimum prominence of peak points
+#%End
+#%Option
+#%  key: scale
+#%  type: string
+#%  required: no
+#%  key_desc: name
+#%  description: Name of output raster map with the largest matrix size at which every cell is a local maximum
+#%  gisprompt: new,cell,raster
+#%End
+#%Option
+#% key: nprocs
+#% type: integer
+#% required: no
+#% description: Number of processes (tiles of rows are filtered in parallel)
+#% answer: 1
+#%End
+############################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+# Every peak point has the value of its maximum, the number of cells of
+# its plateau and the raster row and col of the plateau centroid. With
+# prominence= or min_prominence= it also has its topographic prominence
+# and the elevation of its key col (null for the highest peak of every
+# connected area, whose prominence is the drop to its lowest cell).
+# Prominence is computed on the whole raster in memory, about
+# 80 bytes per cell; the module fails early if that is more than the
+# physical memory.
+#
 ############################################################################
 
 import sys
 import os
-import atexit
 
 try:
     import grass.script as grass
@@ -73,85 +128,231 @@ except:
     try:
         from grass.script import core as grass
     except:
-        if not os.environ.has_key("GISBASE"):
-            print "You must be in GRASS GIS to run this program."
+        if "GISBASE" not in os.environ:
+            print("You must be in GRASS GIS to run this program.")
             sys.exit(1)
 
-def cleanup():
-    nuldev = file(os.devnull, 'w')
-    grass.run_command('g.remove', type_ = 'rast,vect', pattern = 'R_LOCALMAX*', flags = 'f',
-                      quiet = True, stderr = nuldev)
+from ctypes import POINTER
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+from grass.lib.gis import G_gisinit, G_find_raster2, G_percent
+from grass.lib.raster import *
+
+from grass.pygrass.vector import VectorTopo
+from grass.pygrass.vector.geometry import Point
+
+from maxfilter import stream_local_max, multiscale_window_max
+from peaks import select_peaks, prominence, PROMINENCE_CELL_BYTES
+
+# cells of one tile of rows filtered by a worker process
+TILE_CELLS = 1 << 22
+
+def read_rows(infd, ncols, rows):
+    """Rows of an open raster map as float arrays (NaN is null)."""
+    for row in rows:
+        buf = np.empty(ncols)
+        Rast_get_d_row(infd, buf.ctypes.data_as(POINTER(DCELL)), row)
+        yield buf
+
+def physical_memory():
+    """Size of the physical memory in bytes, None if unknown."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+## filtering of tiles ##
+
+_tile = {}
+
+def _init_worker(name, mapset, nrows, ncols, sizes):
+    G_gisinit('')
+    _tile['fd'] = Rast_open_old(name, mapset)
+    _tile['shape'] = (nrows, ncols, sizes)
+
+def _tile_worker(args):
+    # rows [row0, row1) need (msize - 1) / 2 rows of halo above and below
+    row0, row1 = args
+    nrows, ncols, sizes = _tile['shape']
+    half = max(sizes) // 2
+    top = max(0, row0 - half)
+    bottom = min(nrows, row1 + half)
+    arr = np.array(list(read_rows(_tile['fd'], ncols, range(top, bottom))))
+    return np.array([np.where(arr == wmax, arr, np.nan)[row0 - top:row1 - top]
+                     for size, wmax in multiscale_window_max(arr, sizes)])
+
+def tiled_local_max(name, mapset, nrows, ncols, sizes, nprocs):
+    """Rows of local maxima at all <sizes> (one row per size), filtered in
+    tiles by <nprocs> processes and yielded in order; at most 2 * nprocs
+    tiles are kept."""
+    tile_rows = max(max(sizes), TILE_CELLS // max(ncols * len(sizes), 1))
+    tiles = [(row0, min(nrows, row0 + tile_rows)) for row0 in range(0, nrows, tile_rows)]
+    if nprocs <= 1:
+        _init_worker(name, mapset, nrows, ncols, sizes)
+        for tile in tiles:
+            res = _tile_worker(tile)
+            for k in range(res.shape[1]):
+                yield res[:, k]
+        Rast_close(_tile['fd'])
+        return
+    pool = Pool(nprocs, _init_worker, (name, mapset, nrows, ncols, sizes))
+    try:
+        pending = deque()
+        for tile in tiles:
+            pending.append(pool.apply_async(_tile_worker, (tile,)))
+            if len(pending) >= 2 * nprocs:
+                res = pending.popleft().get()
+                for k in range(res.shape[1]):
+                    yield res[:, k]
+        while pending:
+            res = pending.popleft().get()
+            for k in range(res.shape[1]):
+                yield res[:, k]
+    finally:
+        pool.terminate()
+
+def write_peaks(name, rows, cols, values, ncols, min_distance = 0, top_k = 0,
+                sweep = None, min_prominence = 0):
+    reg = grass.region()
+    x, y, attrs = select_peaks(rows, cols, values, ncols, reg['w'], reg['n'],
+                               reg['ewres'], reg['nsres'], min_distance, top_k,
+                               sweep, min_prominence)
+    tab_cols = [(u'cat', 'INTEGER PRIMARY KEY'), (u'value', 'DOUBLE PRECISION'),
+                (u'cells', 'INTEGER'), (u'row', 'INTEGER'), (u'col', 'INTEGER')]
+    if sweep is not None:
+        tab_cols += [(u'prominence', 'DOUBLE PRECISION'), (u'col_elev', 'DOUBLE PRECISION')]
+
+    grass.message(_("Writing %d points to <%s>...") % (len(x), name))
+    types = [float, int, int, int, float, float]
+    new = VectorTopo(name)
+    new.open('w', tab_cols = tab_cols, overwrite = grass.overwrite())
+    for k in range(len(x)):
+        new.write(Point(x[k], y[k]), cat = k + 1,
+                  attrs = tuple(None if np.isnan(a[k]) else t(a[k])
+                                for t, a in zip(types, attrs)))
+    new.table.conn.commit()
+    new.close()
 
 def main():
     inr = options['input']
     outr = options['output']
     outp = options['points']
-    msize = options['msize']
-    msize = int(msize)
+    outscale = options['scale']
+    sizes = sorted(set(int(size) for size in options['msize'].split(',')))
+    nprocs = int(options['nprocs'])
+    min_distance = float(options['min_distance'] or 0)
+    top_k = int(options['top_k'] or 0)
+    outprom = options['prominence']
+    min_prominence = float(options['min_prominence'] or 0)
     
     global nuldev
     nuldev = None
 
-    mmax = (msize-1)/2
+    for msize in sizes:
+        if msize < 1 or msize % 2 == 0:
+            grass.fatal(_("Matrix size must be an odd number"))
+    if not grass.find_file(inr, element = 'cell')['file']:
+        grass.fatal(_("Raster map <%s> not found") % inr)
+
+    if len(sizes) == 1:
+        out_maps = [outr]
+        out_points = [outp]
+    else:
+        out_maps = ['%s_%d' % (outr, size) for size in sizes]
+        out_points = ['%s_%d' % (outp, size) for size in sizes]
 
-    mapcalc_str1 = "%s = if(%s == max(" % (outr, inr)
-    mapcalc_list = []
+    ## initialize GRASS Ctypes library
+    G_gisinit('')
+    mapset = G_find_raster2(inr, "")
+    map_type = Rast_map_type(inr, mapset)
+    nrows = Rast_window_rows()
+    ncols = Rast_window_cols()
 
-    i = 0
-    j = 0
-    for x in xrange(i, msize):
-        for y in xrange(j, msize):
-            mapcalc_list.append("%s[%d,%d]" % (inr, -(mmax)+x, -(mmax)+y))
-    mapcalc_str2 = ','.join(mapcalc_list)
-    mapcalc_str3 = mapcalc_str1 + mapcalc_str2 + ("),%s,null())" % inr)
+    # prominence needs the whole raster in memory: check it before filtering
+    if outprom or min_prominence > 0:
+        need = nrows * ncols * PROMINENCE_CELL_BYTES
+        total = physical_memory()
+        if total and need > total:
+            grass.fatal(_("Prominence of %d cells needs about %d MB of memory, "
+                          "more than the %d MB of physical memory. Reduce the region.")
+                        % (nrows * ncols, need >> 20, total >> 20))
+        if total and need > total // 2:
+            grass.warning(_("Prominence of %d cells needs about %d MB of memory")
+                          % (nrows * ncols, need >> 20))
 
-    grass.mapcalc(mapcalc_str3)
+    # cells equal to the maximum of the msize x msize window around them
+    # (like r.mapcalc "if(inr == max(inr[-m,-m], ..., inr[m,m]), inr, null())"),
+    # streamed row by row with about 2 * msize rows in memory, or
+    # filtered in tiles of rows (several sizes at once, several processes)
+    grass.message(_("Filtering local maxima..."))
+    if nprocs > 1 or len(sizes) > 1:
+        infd = None
+        maxima = tiled_local_max(inr, mapset, nrows, ncols, sizes, nprocs)
+    else:
+        infd = Rast_open_old(inr, mapset)
+        rows = read_rows(infd, ncols, range(nrows))
+        maxima = (out[None] for out in stream_local_max(rows, nrows, ncols, sizes[0]))
+    outfd = [Rast_open_new(name, map_type) for name in out_maps]
+    scalefd = Rast_open_new(outscale, CELL_TYPE) if outscale else None
+    cands = [([], [], []) for size in sizes]
+    for row, out in enumerate(maxima):
+        out = np.ascontiguousarray(out)
+        for fd, orow in zip(outfd, out):
+            Rast_put_d_row(fd, orow.ctypes.data_as(POINTER(DCELL)))
+        if scalefd is not None:
+            # largest size at which the cell is a maximum, null if none
+            found = ~np.isnan(out)
+            last = len(sizes) - 1 - np.argmax(found[::-1], axis = 0)
+            srow = np.where(found.any(axis = 0), np.array(sizes)[last], np.nan)
+            Rast_put_d_row(scalefd, srow.ctypes.data_as(POINTER(DCELL)))
+        if outp:
+            for (cand_rows, cand_cols, cand_values), orow in zip(cands, out):
+                found = np.flatnonzero(~np.isnan(orow))
+                cand_rows.append(np.full(len(found), row))
+                cand_cols.append(found)
+                cand_values.append(orow[found])
+        G_percent(row, nrows, 2)
+    if infd is not None:
+        Rast_close(infd)
+    for fd in outfd:
+        Rast_close(fd)
+    for name in out_maps:
+        grass.raster_history(name)
+    if scalefd is not None:
+        Rast_close(scalefd)
+        grass.raster_history(outscale)
     
+    # prominence needs the whole raster: sweep over all cells from the
+    # highest one (all scales share it)
+    sweep = None
+    if outprom or min_prominence > 0:
+        grass.message(_("Computing prominence..."))
+        infd = Rast_open_old(inr, mapset)
+        arr = np.empty((nrows, ncols))
+        for row, buf in enumerate(read_rows(infd, ncols, range(nrows))):
+            arr[row] = buf
+        Rast_close(infd)
+        prom, col, top = prominence(arr)
+        sweep = (arr, prom, col, top)
+        if outprom:
+            promfd = Rast_open_new(outprom, map_type)
+            for row in prom:
+                Rast_put_d_row(promfd, row.ctypes.data_as(POINTER(DCELL)))
+            Rast_close(promfd)
+            grass.raster_history(outprom)
+
     if outp:
-        vect1 = 'R_LOCALMAX_vect1'
-        grass.run_command('r.to.vect',
-                        input_ = outr, output = vect1,
-                        type_ = 'point',
-                        quiet = True, stderr = nuldev)
-        res = grass.raster_info(inr)['nsres']
-        vect2 = 'R_LOCALMAX_vect2'
-        grass.run_command('v.buffer',
-                        input_ = vect1, output = vect2,
-                        dist = res*2,
-                        quiet = True, stderr = nuldev)
-        vect3 = 'R_LOCALMAX_vect3'
-        grass.run_command('v.type',
-                          input_ = vect2, output = vect3,
-                          from_type_ = 'centroid',
-                          to_type = 'point',
-                          quiet = True, stderr = nuldev)
-        vect4 = 'R_LOCALMAX_vect4'
-        grass.run_command('v.category',
-                          input_ = vect3, opt = 'del', 
-                          output = vect4,
-                          quiet = True, stderr = nuldev)
-        vect5 = 'R_LOCALMAX_vect5'
-        grass.run_command('v.category',
-                          input_ = vect4, opt = 'add', 
-                          output = vect5,
-                          quiet = True, stderr = nuldev)
-        grass.run_command('v.db.addtable',
-                          map_ = vect5, columns = 'dist double',
-                          quiet = True, stderr = nuldev)
-        vect6 = 'R_LOCALMAX_vect6'
-        grass.run_command('v.distance',
-                          from_ = vect5, from_type = 'point',
-                          to = vect1, to_type = 'point',
-                          output = vect6,  upload = 'dist', column = 'dist',
-                          quiet = True, stderr = nuldev)
-        grass.run_command('v.select',
-                          ainput = vect1, binput = vect6,
-                          output = outp,
-                          quiet = True, stderr = nuldev)
-
-        return 0
+        grass.message(_("Extracting peaks..."))
+        for name, (cand_rows, cand_cols, cand_values) in zip(out_points, cands):
+            write_peaks(name, np.concatenate(cand_rows), np.concatenate(cand_cols),
+                        np.concatenate(cand_values), ncols, min_distance, top_k,
+                        sweep, min_prominence)
+
+    return 0
         
 if __name__ == "__main__":
     options, flags = grass.parser()
-    atexit.register(cleanup)
     sys.exit(main())
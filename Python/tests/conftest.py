@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the helper modules live next to the module scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,61 @@
+import numpy as np
+
+from maxfilter import local_max
+from peaks import prominence, select_peaks
+
+
+def candidates(arr, size):
+    # candidate cells like <r.localmax> collects them from the filtered rows
+    out = local_max(arr, size)
+    rows, cols = np.nonzero(~np.isnan(out))
+    return rows, cols, out[rows, cols]
+
+
+def two_peaks():
+    # peaks of 9 and 7 joined by a col of 4, on a base of 1
+    arr = np.ones((7, 11))
+    arr[1:6, 1:10] = 2
+    arr[3, 2:9] = 4
+    arr[3, 2] = 9
+    arr[3, 8] = 7
+    return arr
+
+
+def test_points_with_prominence():
+    arr = two_peaks()
+    rows, cols, values = candidates(arr, 3)
+    x, y, attrs = select_peaks(rows, cols, values, arr.shape[1],
+                               100.0, 200.0, 10.0, 10.0,
+                               sweep = (arr,) + prominence(arr), min_prominence = 1)
+    value, cells, row, col, prom, col_elev = attrs
+    order = np.argsort(-value)
+    assert value[order].tolist() == [9, 7]
+    assert prom[order].tolist() == [8, 3]
+    assert np.isnan(col_elev[order][0]) and col_elev[order][1] == 4
+    assert (row[order].tolist(), col[order].tolist()) == ([3, 3], [2, 8])
+    assert x[order].tolist() == [125.0, 185.0]
+    assert y[order].tolist() == [165.0, 165.0]
+
+
+def test_min_prominence_and_top_k():
+    arr = two_peaks()
+    rows, cols, values = candidates(arr, 3)
+    sweep = (arr,) + prominence(arr)
+    x, y, attrs = select_peaks(rows, cols, values, arr.shape[1], 0, 0, 1, 1,
+                               sweep = sweep, min_prominence = 5)
+    assert attrs[0].tolist() == [9]
+    x, y, attrs = select_peaks(rows, cols, values, arr.shape[1], 0, 0, 1, 1,
+                               top_k = 1, sweep = sweep, min_prominence = 1)
+    assert attrs[0].tolist() == [9]
+    assert len(attrs) == 6
+
+
+def test_plateau_is_one_point():
+    arr = np.zeros((5, 6))
+    arr[1:3, 1:4] = 5
+    rows, cols, values = candidates(arr, 3)
+    x, y, attrs = select_peaks(rows, cols, values, arr.shape[1], 0, 0, 1, 1,
+                               sweep = (arr,) + prominence(arr))
+    assert attrs[0].tolist() == [5]
+    assert attrs[1].tolist() == [6]
+    assert attrs[4].tolist() == [5]
@@ -0,0 +1,55 @@
+import numpy as np
+
+from tincontour import contour_segments, chain_segments, drop_repeated
+
+
+def contour_lines(nodes, ele, levels):
+    xy, lev, segments = contour_segments(nodes, ele, np.asarray(levels, dtype = float))
+    return xy, drop_repeated(xy, chain_segments(len(xy), segments))
+
+
+def pyramid(top):
+    # square of 4 triangles around a centre node
+    nodes = np.array([[0, 0, 100], [10, 0, 100], [10, 10, 100], [0, 10, 100],
+                      [5, 5, top]], dtype = float)
+    ele = np.array([[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]])
+    return nodes, ele
+
+
+def grid_tin(n, seed):
+    # jittered grid with integer z, so that many nodes lie on integer levels
+    rng = np.random.RandomState(seed)
+    x, y = np.meshgrid(np.arange(n) * 1.7, np.arange(n) * 1.3)
+    x = x + rng.uniform(-0.4, 0.4, x.shape)
+    y = y + rng.uniform(-0.4, 0.4, y.shape)
+    z = rng.randint(0, 6, x.shape)
+    i, j = np.meshgrid(np.arange(n - 1), np.arange(n - 1))
+    a = (j * n + i).ravel()
+    ele = np.concatenate([np.c_[a, a + 1, a + n + 1], np.c_[a, a + n + 1, a + n]])
+    return np.c_[x.ravel(), y.ravel(), z.ravel()].astype(float), ele
+
+
+def test_peak_on_level_gives_no_line():
+    nodes, ele = pyramid(200)
+    xy, lines = contour_lines(nodes, ele, [200])
+    assert lines == []
+
+
+def test_contour_through_node_is_one_line():
+    nodes, ele = pyramid(200)
+    nodes[2, 2] = 300
+    xy, lines = contour_lines(nodes, ele, [200])
+    assert len(lines) == 1
+    assert xy[lines[0]].tolist() == [[10, 5], [5, 5], [5, 10]]
+
+
+def test_nodes_on_levels_give_no_degenerate_lines():
+    nodes, ele = grid_tin(30, 1)
+    xy, lines = contour_lines(nodes, ele, np.arange(6))
+    assert lines
+    for line in lines:
+        p = xy[line]
+        # near-duplicates count as repeated points
+        step = np.hypot(*(p[1:] - p[:-1]).T)
+        assert (step > 1e-9).all()
+        assert np.ptp(p, axis = 0).max() > 1e-9
@@ -0,0 +1,271 @@
+############################################################################
+#
+# TIN as NumPy arrays: reading of <Triangle> output and of TIN vector
+# maps, and the triangulation cache shared by <v.triangle> and
+# <v.tin.to.rast>.
+#
+#   nodes - (N, 3) float array of x, y, z
+#   ele   - (M, 3) int array of node indices (counterclockwise)
+#   neigh - (M, 3) int array, neigh[t, j] is the triangle opposite to
+#           node ele[t, j] or -1 on the convex hull
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import os
+import hashlib
+
+import numpy as np
+
+import grass.script as grass
+
+from ctypes import pointer
+from grass.lib.gis import G_find_vector2
+from grass.lib.vector import (Map_info, Vect_set_open_level, Vect_open_old,
+                              Vect_close, Vect_get_num_areas, Vect_area_alive,
+                              Vect_get_area_points, Vect_new_line_struct,
+                              Vect_destroy_line_struct)
+
+
+def _read_table(path):
+    # Triangle files: header line, then rows starting with the index
+    return np.loadtxt(path, skiprows = 1, comments = '#', ndmin = 2)
+
+
+def read_triangle(prefix):
+    """Read <prefix>.node, <prefix>.ele and <prefix>.neigh files of Triangle."""
+    node = _read_table(prefix + '.node')
+    ele = _read_table(prefix + '.ele')
+    # Triangle numbers nodes from the first index of its input
+    base = int(node[0, 0])
+    nodes = node[:, 1:4].copy()
+    ele = ele[:, 1:4].astype(np.int64) - base
+    if os.path.exists(prefix + '.neigh'):
+        neigh = _read_table(prefix + '.neigh')[:, 1:4].astype(np.int64)
+        neigh = np.where(neigh < 0, -1, neigh - base)
+    else:
+        neigh = element_neighbours(ele)
+    return nodes, ele, neigh
+
+
+def element_neighbours(ele):
+    """Triangle neighbours from the element array (Triangle's convention)."""
+    m = len(ele)
+    a = np.concatenate([ele[:, 1], ele[:, 2], ele[:, 0]])
+    b = np.concatenate([ele[:, 2], ele[:, 0], ele[:, 1]])
+    lo = np.minimum(a, b)
+    hi = np.maximum(a, b)
+    tri = np.tile(np.arange(m), 3)
+    opp = np.repeat(np.arange(3), m)
+    order = np.lexsort((hi, lo))
+    lo = lo[order]
+    hi = hi[order]
+    i = np.flatnonzero((lo[1:] == lo[:-1]) & (hi[1:] == hi[:-1]))
+    t1 = tri[order[i]]
+    t2 = tri[order[i + 1]]
+    neigh = -np.ones((m, 3), dtype = np.int64)
+    neigh[t1, opp[order[i]]] = t2
+    neigh[t2, opp[order[i + 1]]] = t1
+    return neigh
+
+
+def plane_coefficients(nodes, ele):
+    """Planes z = a * x + b * y + c of all triangles as a (M, 3) array."""
+    p = nodes[ele]
+    u = p[:, 1] - p[:, 0]
+    v = p[:, 2] - p[:, 0]
+    n = np.cross(u, v)
+    nz = np.where(n[:, 2] != 0, n[:, 2], np.nan)
+    a = -n[:, 0] / nz
+    b = -n[:, 1] / nz
+    c = p[:, 0, 2] - a * p[:, 0, 0] - b * p[:, 0, 1]
+    return np.c_[a, b, c]
+
+
+def triangle_boxes(nodes, ele):
+    """Bounding boxes (xmin, ymin, xmax, ymax) of all triangles."""
+    p = nodes[ele][:, :, :2]
+    return np.c_[p.min(axis = 1), p.max(axis = 1)]
+
+
+def grid_cover(boxes, origin, cell, ncols):
+    """Grid cells covered by every box, as (cell id, box id) pairs."""
+    c0 = np.floor((boxes[:, 0] - origin[0]) / cell).astype(np.int64)
+    r0 = np.floor((boxes[:, 1] - origin[1]) / cell).astype(np.int64)
+    c1 = np.floor((boxes[:, 2] - origin[0]) / cell).astype(np.int64)
+    r1 = np.floor((boxes[:, 3] - origin[1]) / cell).astype(np.int64)
+    nc = c1 - c0 + 1
+    n = nc * (r1 - r0 + 1)
+    owner = np.repeat(np.arange(len(boxes)), n)
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    col = c0[owner] + k % nc[owner]
+    row = r0[owner] + k // nc[owner]
+    return row * ncols + col, owner
+
+
+def box_pairs(boxa, boxb, cell = None):
+    """Pairs (i, j) of overlapping boxes boxa[i] and boxb[j], found
+    through a uniform grid."""
+    if not len(boxa) or not len(boxb):
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    if not cell:
+        cell = max(np.mean(boxb[:, 2] - boxb[:, 0]),
+                   np.mean(boxb[:, 3] - boxb[:, 1]))
+    if not cell > 0:
+        cell = 1.0
+    origin = np.minimum(boxa[:, :2].min(axis = 0), boxb[:, :2].min(axis = 0))
+    far = np.maximum(boxa[:, 2:].max(axis = 0), boxb[:, 2:].max(axis = 0))
+    ncols = int((far[0] - origin[0]) // cell) + 1
+
+    cella, owna = grid_cover(boxa, origin, cell, ncols)
+    cellb, ownb = grid_cover(boxb, origin, cell, ncols)
+    order = np.argsort(cellb, kind = 'stable')
+    cellb = cellb[order]
+    ownb = ownb[order]
+    lo = np.searchsorted(cellb, cella, side = 'left')
+    hi = np.searchsorted(cellb, cella, side = 'right')
+    n = hi - lo
+    i = np.repeat(owna, n)
+    j = ownb[np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)]
+
+    # boxes sharing several cells
+    pair = np.unique(i * len(boxb) + j)
+    i = pair // len(boxb)
+    j = pair % len(boxb)
+    hit = ((boxa[i, 0] <= boxb[j, 2]) & (boxb[j, 0] <= boxa[i, 2]) &
+           (boxa[i, 1] <= boxb[j, 3]) & (boxb[j, 1] <= boxa[i, 3]))
+    return i[hit], j[hit]
+
+
+def write_ascii(nodes, ele, path):
+    """Write triangles as closed 3D boundaries for 'v.in.ascii format=standard'."""
+    ring = nodes[np.c_[ele, ele[:, 0]]]
+    with open(path, 'w') as fout:
+        for tri in ring:
+            fout.write('B 4\n')
+            np.savetxt(fout, tri, fmt = '%.15g', delimiter = ' ')
+
+
+def tin_from_vector(mapname):
+    """Read triangles of a TIN vector map in one pass over its areas.
+
+    G_gisinit() must be called before.
+    """
+    mapset = G_find_vector2(mapname, "")
+    if not mapset:
+        grass.fatal(_("Vector map <%s> not found") % mapname)
+
+    map_info = pointer(Map_info())
+    Vect_set_open_level(2)
+    Vect_open_old(map_info, mapname, mapset)
+
+    points = Vect_new_line_struct()
+    nareas = Vect_get_num_areas(map_info)
+    xyz = np.empty((nareas, 3, 3))
+    keep = np.zeros(nareas, dtype = bool)
+    for area in range(1, nareas + 1):
+        if not Vect_area_alive(map_info, area):
+            continue
+        Vect_get_area_points(map_info, area, points)
+        p = points.contents
+        # skip everything that is not a triangle (closed ring of 4 points)
+        if p.n_points != 4:
+            continue
+        xyz[area - 1] = [(p.x[k], p.y[k], p.z[k]) for k in range(3)]
+        keep[area - 1] = True
+    Vect_destroy_line_struct(points)
+    Vect_close(map_info)
+
+    xyz = xyz[keep].reshape(-1, 3)
+    xy, first, inv = np.unique(xyz[:, :2], axis = 0, return_index = True,
+                               return_inverse = True)
+    nodes = xyz[first]
+    ele = inv.reshape(-1, 3).astype(np.int64)
+
+    # counterclockwise orientation
+    p = nodes[ele]
+    area2 = ((p[:, 1, 0] - p[:, 0, 0]) * (p[:, 2, 1] - p[:, 0, 1]) -
+             (p[:, 2, 0] - p[:, 0, 0]) * (p[:, 1, 1] - p[:, 0, 1]))
+    cw = area2 < 0
+    ele[cw] = ele[cw][:, [0, 2, 1]]
+
+    return nodes, ele, element_neighbours(ele)
+
+
+##############################
+### triangulation cache ######
+##############################
+
+def cache_dir():
+    env = grass.gisenv()
+    return os.path.join(env['GISDBASE'], env['LOCATION_NAME'],
+                        env['MAPSET'], 'tincache')
+
+
+def cache_key(paths, switches):
+    """Hash of Triangle input files plus Triangle switches."""
+    sha = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                sha.update(chunk)
+    sha.update(' '.join(switches).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def arrays_key(*arrays):
+    """Hash of the triangulation arrays themselves (for edited TINs)."""
+    sha = hashlib.sha1()
+    for arr in arrays:
+        sha.update(np.ascontiguousarray(arr).tobytes())
+    return sha.hexdigest()
+
+
+def load_cache(key):
+    path = os.path.join(cache_dir(), key)
+    if not os.path.isdir(path):
+        return None
+    return tuple(np.load(os.path.join(path, name + '.npy'))
+                 for name in ('nodes', 'ele', 'neigh'))
+
+
+def save_cache(key, nodes, ele, neigh):
+    path = os.path.join(cache_dir(), key)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, arr in (('nodes', nodes), ('ele', ele), ('neigh', neigh)):
+        np.save(os.path.join(path, name + '.npy'), arr)
+
+
+def link_map(mapname, key):
+    """Remember that the vector map <mapname> was built from cache entry <key>."""
+    path = os.path.join(cache_dir(), 'maps')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    # links are by plain map name, the cache is in the current mapset
+    with open(os.path.join(path, mapname.split('@')[0]), 'w') as fout:
+        fout.write(key + '\n')
+
+
+def cached_map(mapname):
+    """Cache entry of a TIN map, if the map was not modified after linking."""
+    vect = grass.find_file(mapname, element = 'vector')
+    if vect['mapset'] != grass.gisenv()['MAPSET']:
+        return None
+    link = os.path.join(cache_dir(), 'maps', vect['name'])
+    coor = os.path.join(vect['file'], 'coor')
+    if not os.path.exists(link) or not os.path.exists(coor):
+        return None
+    if os.path.getmtime(link) < os.path.getmtime(coor):
+        return None
+    with open(link) as fin:
+        return load_cache(fin.read().strip())
+
+
+def load_tin(mapname):
+    """TIN arrays of a vector map: from the cache if possible, else from topology."""
+    tin = cached_map(mapname)
+    if tin is not None:
+        return tin
+    return tin_from_vector(mapname)
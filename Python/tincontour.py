@@ -0,0 +1,119 @@
+############################################################################
+#
+# Contours of a TIN (see tinarrays.py) for <v.tin.contour> by "marching
+# triangles": the crossings of all edges with all levels are computed
+# at once, joined into segments inside the triangles and chained into
+# lines through shared crossings.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import numpy as np
+
+
+def tin_edges(ele):
+    # unique edges and edge ids of every triangle side
+    a = ele.ravel()
+    b = ele[:, [1, 2, 0]].ravel()
+    key = np.c_[np.minimum(a, b), np.maximum(a, b)]
+    edges, inv = np.unique(key, axis = 0, return_inverse = True)
+    return edges, inv.reshape(-1, 3)
+
+
+def level_ranges(zlo, zhi, levels):
+    # levels crossed by edges: zlo < level <= zhi (a node exactly on
+    # a level counts as above it, so every triangle has 0 or 2 crossings)
+    first = np.searchsorted(levels, zlo, side = 'right')
+    last = np.searchsorted(levels, zhi, side = 'right')
+    return first, last - first
+
+
+def expand(first, counts):
+    # (owner, level index) pairs of the ranges [first, first + counts)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, first[owner] + offset
+
+
+def contour_segments(nodes, ele, levels):
+    """Crossing points of all edges with all levels and the segments
+    joining them inside the triangles (vectorized)."""
+    edges, tri_edge = tin_edges(ele)
+    z0 = nodes[edges[:, 0], 2]
+    z1 = nodes[edges[:, 1], 2]
+    first, counts = level_ranges(np.minimum(z0, z1), np.maximum(z0, z1), levels)
+
+    # crossing points, ordered by edge and level
+    edge, lev = expand(first, counts)
+    t = (levels[lev] - z0[edge]) / (z1[edge] - z0[edge])
+    p0 = nodes[edges[edge, 0], :2]
+    p1 = nodes[edges[edge, 1], :2]
+    xy = p0 + t[:, None] * (p1 - p0)
+    # a node exactly on a level is the crossing of all its edges: use its
+    # coordinates, p0 + (p1 - p0) may differ from p1 in the last bits
+    xy[t == 1] = p1[t == 1]
+    start = np.cumsum(counts) - counts
+
+    # triangle sides crossing a level, grouped by triangle and level
+    side = tri_edge.ravel()
+    tri = np.repeat(np.arange(len(ele)), 3)
+    owner, slev = expand(first[side], counts[side])
+    cross = start[side[owner]] + slev - first[side[owner]]
+    order = np.lexsort((slev, tri[owner]))
+    cross = cross[order]
+    segments = cross.reshape(-1, 2)
+    return xy, lev, segments
+
+
+def chain_segments(ncross, segments):
+    """Join segments sharing crossing points into polylines."""
+    partner = -np.ones((ncross, 2), dtype = np.int64)
+    deg = np.zeros(ncross, dtype = np.int64)
+    for a, b in segments:
+        partner[a, deg[a]] = b
+        deg[a] += 1
+        partner[b, deg[b]] = a
+        deg[b] += 1
+
+    visited = np.zeros(ncross, dtype = bool)
+    lines = []
+    # open lines start at crossings on the TIN hull, then closed rings
+    starts = list(np.flatnonzero(deg == 1)) + list(np.flatnonzero(deg == 2))
+    for s in starts:
+        if visited[s]:
+            continue
+        line = [s]
+        visited[s] = True
+        prev, cur = -1, s
+        while True:
+            nxt = partner[cur, 0] if partner[cur, 0] != prev else partner[cur, 1]
+            if nxt < 0:
+                break
+            if visited[nxt]:
+                if nxt == s:
+                    line.append(s)
+                break
+            line.append(nxt)
+            visited[nxt] = True
+            prev, cur = cur, nxt
+        if len(line) > 1:
+            lines.append(line)
+    return lines
+
+
+def drop_repeated(xy, lines):
+    """Lines without repeated points, dropping lines of zero length.
+
+    Crossings at a node exactly on a level coincide, so a contour through
+    the node has repeated points and a node with all neighbours lower
+    gives a closed line of one point.
+    """
+    out = []
+    for line in lines:
+        line = np.asarray(line)
+        p = xy[line]
+        keep = np.r_[True, (p[1:] != p[:-1]).any(axis = 1)]
+        if keep.sum() > 1:
+            out.append(line[keep])
+    return out
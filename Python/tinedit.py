@@ -0,0 +1,258 @@
+############################################################################
+#
+# Incremental update of a Delaunay TIN given by node, element and
+# neighbour arrays (see tinarrays.py): Bowyer-Watson insertion of points
+# and removal of points with retriangulation of the hole.
+#
+# Only the triangles touched by an edit are visited, so the cost of an
+# update depends on the size of the edit, not on the size of the TIN.
+# Constrained edges (breaklines) are not known to the arrays and are
+# treated as ordinary Delaunay edges.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import random
+
+import numpy as np
+
+
+def orient(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def incircle(a, b, c, d):
+    """Positive if <d> lies inside the circumcircle of counterclockwise <a, b, c>."""
+    adx = a[0] - d[0]
+    ady = a[1] - d[1]
+    bdx = b[0] - d[0]
+    bdy = b[1] - d[1]
+    cdx = c[0] - d[0]
+    cdy = c[1] - d[1]
+    ad = adx * adx + ady * ady
+    bd = bdx * bdx + bdy * bdy
+    cd = cdx * cdx + cdy * cdy
+    return (adx * (bdy * cd - bd * cdy) -
+            ady * (bdx * cd - bd * cdx) +
+            ad * (bdx * cdy - bdy * cdx))
+
+
+class TinEditor(object):
+    """Editable triangulation.
+
+    Triangles are never moved: removed triangles are only marked dead and
+    new ones are appended, so triangle and node ids stay valid during an
+    editing session. arrays() returns the compacted result.
+    """
+
+    def __init__(self, nodes, ele, neigh):
+        self.nodes = nodes.tolist()
+        self.ele = ele.tolist()
+        self.neigh = neigh.tolist()
+        self.ntri0 = len(self.ele)
+        self.tri_alive = [True] * len(self.ele)
+        self.node_alive = [True] * len(self.nodes)
+        # one triangle incident to every node
+        self.node_tri = [-1] * len(self.nodes)
+        for t, tri in enumerate(self.ele):
+            for n in tri:
+                self.node_tri[n] = t
+        self.last = len(self.ele) - 1
+
+    ## point location ##
+
+    def locate(self, p):
+        """Triangle containing point <p> or -1 outside of the TIN or on
+        its convex hull."""
+        t = self.last
+        if t < 0 or not self.tri_alive[t]:
+            t = self.tri_alive.index(True)
+        for step in range(len(self.ele) + 1):
+            tri = self.ele[t]
+            moved = False
+            for j in random.sample(range(3), 3):
+                a = self.nodes[tri[(j + 1) % 3]]
+                b = self.nodes[tri[(j + 2) % 3]]
+                side = orient(a, b, p)
+                if side < 0:
+                    t = self.neigh[t][j]
+                    moved = True
+                    break
+                if side == 0 and self.neigh[t][j] < 0:
+                    # on the hull: the new triangle would be flat
+                    return -1
+            if not moved:
+                return t
+            if t < 0:
+                return -1
+        return -1
+
+    ## relinking of a retriangulated polygon ##
+
+    def _retriangulate(self, cavity, new_tris):
+        """Replace triangles <cavity> with <new_tris> and fix the neighbours."""
+        # polygon edges, oriented as seen from inside, with outer triangles
+        border = {}
+        for t in cavity:
+            tri = self.ele[t]
+            for j in range(3):
+                n = self.neigh[t][j]
+                if n < 0 or n not in cavity:
+                    border[(tri[(j + 1) % 3], tri[(j + 2) % 3])] = n
+            self.tri_alive[t] = False
+
+        created = []
+        inner = {}
+        for tri in new_tris:
+            t = len(self.ele)
+            self.ele.append(list(tri))
+            self.neigh.append([-1, -1, -1])
+            self.tri_alive.append(True)
+            created.append(t)
+            for n in tri:
+                self.node_tri[n] = t
+            for j in range(3):
+                edge = (tri[(j + 1) % 3], tri[(j + 2) % 3])
+                if edge in border:
+                    out = border[edge]
+                    self.neigh[t][j] = out
+                    if out >= 0:
+                        # point the outer triangle to the new one
+                        otri = self.ele[out]
+                        for k in range(3):
+                            if (otri[(k + 1) % 3], otri[(k + 2) % 3]) == (edge[1], edge[0]):
+                                self.neigh[out][k] = t
+                elif (edge[1], edge[0]) in inner:
+                    u, k = inner.pop((edge[1], edge[0]))
+                    self.neigh[t][j] = u
+                    self.neigh[u][k] = t
+                else:
+                    inner[edge] = (t, j)
+        self.last = created[-1]
+        return created
+
+    ## editing ##
+
+    def insert(self, x, y, z):
+        """Insert a point (Bowyer-Watson). Returns False outside of the TIN."""
+        p = (x, y, z)
+        t = self.locate(p)
+        if t < 0:
+            return False
+        for n in self.ele[t]:
+            if self.nodes[n][0] == x and self.nodes[n][1] == y:
+                return False
+
+        # cavity: connected triangles whose circumcircle contains the point
+        cavity = set([t])
+        stack = [t]
+        while stack:
+            u = stack.pop()
+            for n in self.neigh[u]:
+                if n < 0 or n in cavity:
+                    continue
+                a, b, c = [self.nodes[i] for i in self.ele[n]]
+                if incircle(a, b, c, p) > 0:
+                    cavity.add(n)
+                    stack.append(n)
+
+        v = len(self.nodes)
+        self.nodes.append([x, y, z])
+        self.node_alive.append(True)
+        self.node_tri.append(t)
+
+        new_tris = []
+        for u in cavity:
+            tri = self.ele[u]
+            for j in range(3):
+                n = self.neigh[u][j]
+                if n < 0 or n not in cavity:
+                    new_tris.append((v, tri[(j + 1) % 3], tri[(j + 2) % 3]))
+        self._retriangulate(cavity, new_tris)
+        return True
+
+    def star(self, v):
+        """Triangles and outer polygon around node <v> in counterclockwise
+        order, or None for nodes on the convex hull or in no triangle
+        (duplicates ignored by Triangle)."""
+        t0 = self.node_tri[v]
+        if t0 < 0:
+            return None
+        tris = []
+        ring = []
+        t = t0
+        while True:
+            tri = self.ele[t]
+            i = tri.index(v)
+            a = tri[(i + 1) % 3]
+            tris.append(t)
+            ring.append(a)
+            # next triangle counterclockwise shares the edge (v, b)
+            t = self.neigh[t][(i + 1) % 3]
+            if t < 0:
+                return None
+            if t == t0:
+                return tris, ring
+
+    def remove(self, v):
+        """Remove node <v> and retriangulate its star. Returns False for
+        nodes on the convex hull."""
+        star = self.star(v)
+        if star is None:
+            return False
+        tris, ring = star
+
+        # Delaunay ear cutting of the star-shaped hole
+        new_tris = []
+        ring = list(ring)
+        while len(ring) > 3:
+            k = len(ring)
+            for i in range(k):
+                u, w, x = ring[i - 1], ring[i], ring[(i + 1) % k]
+                a, b, c = self.nodes[u], self.nodes[w], self.nodes[x]
+                if orient(a, b, c) <= 0:
+                    continue
+                if any(incircle(a, b, c, self.nodes[r]) > 0
+                       for r in ring if r not in (u, w, x)):
+                    continue
+                new_tris.append((u, w, x))
+                del ring[i]
+                break
+            else:
+                # degenerate (cocircular) hole: cut any convex ear
+                for i in range(k):
+                    u, w, x = ring[i - 1], ring[i], ring[(i + 1) % k]
+                    if orient(self.nodes[u], self.nodes[w], self.nodes[x]) > 0:
+                        new_tris.append((u, w, x))
+                        del ring[i]
+                        break
+        new_tris.append(tuple(ring))
+
+        self.node_alive[v] = False
+        self._retriangulate(set(tris), new_tris)
+        return True
+
+    ## results ##
+
+    def removed(self):
+        """Ids of original triangles deleted during the session."""
+        return [t for t in range(self.ntri0) if not self.tri_alive[t]]
+
+    def added(self):
+        """Ids of triangles created during the session and still alive."""
+        return [t for t in range(self.ntri0, len(self.ele)) if self.tri_alive[t]]
+
+    def triangle_coords(self, tris):
+        return np.array([[self.nodes[n] for n in self.ele[t]] for t in tris]).reshape(-1, 3, 3)
+
+    def arrays(self):
+        """Compacted node, element and neighbour arrays."""
+        node_alive = np.array(self.node_alive)
+        tri_alive = np.array(self.tri_alive)
+        node_id = np.cumsum(node_alive) - 1
+        tri_id = np.append(np.cumsum(tri_alive) - 1, -1)
+        nodes = np.array(self.nodes)[node_alive]
+        ele = node_id[np.array(self.ele, dtype = np.int64)[tri_alive]]
+        neigh = tri_id[np.array(self.neigh, dtype = np.int64)[tri_alive]]
+        return nodes, ele, neigh
@@ -0,0 +1,91 @@
+############################################################################
+#
+# Spatial index of TIN triangles (see tinarrays.py) on a uniform grid,
+# for vectorized sampling of the TIN surface at many points at once.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+import numpy as np
+
+from tinarrays import plane_coefficients, triangle_boxes, grid_cover
+
+# tolerance of barycentric weights for points on triangle edges
+EPS = 1e-9
+
+
+class TinIndex(object):
+    """Triangles binned into the cells of a uniform grid.
+
+    >>> index = TinIndex(nodes, ele)
+    >>> z, slope = index.sample(x, y, slope = True)
+    """
+
+    def __init__(self, nodes, ele, cell = None):
+        self.nodes = nodes
+        self.ele = ele
+        self.planes = plane_coefficients(nodes, ele)
+        boxes = triangle_boxes(nodes, ele)
+        if not cell:
+            cell = max(np.mean(boxes[:, 2] - boxes[:, 0]),
+                       np.mean(boxes[:, 3] - boxes[:, 1]))
+        if not cell > 0:
+            cell = 1.0
+        self.cell = cell
+        self.origin = boxes[:, :2].min(axis = 0)
+        far = boxes[:, 2:].max(axis = 0)
+        self.ncols = int((far[0] - self.origin[0]) // cell) + 1
+        self.nrows = int((far[1] - self.origin[1]) // cell) + 1
+
+        cells, tris = grid_cover(boxes, self.origin, cell, self.ncols)
+        order = np.argsort(cells, kind = 'stable')
+        self.tris = tris[order]
+        self.indptr = np.searchsorted(cells[order],
+                                      np.arange(self.ncols * self.nrows + 1))
+
+    def locate(self, x, y):
+        """Triangle containing every point, -1 outside of the TIN."""
+        found = -np.ones(len(x), dtype = np.int64)
+        col = np.floor((x - self.origin[0]) / self.cell).astype(np.int64)
+        row = np.floor((y - self.origin[1]) / self.cell).astype(np.int64)
+        ok = (col >= 0) & (col < self.ncols) & (row >= 0) & (row < self.nrows)
+        cid = np.where(ok, row * self.ncols + col, 0)
+        start = self.indptr[cid]
+        count = np.where(ok, self.indptr[cid + 1] - start, 0)
+
+        # k-th candidate triangle of every point still not located
+        for k in range(int(count.max()) if len(count) else 0):
+            todo = np.flatnonzero((count > k) & (found < 0))
+            if not len(todo):
+                break
+            t = self.tris[start[todo] + k]
+            p = self.nodes[self.ele[t]]
+            px = x[todo]
+            py = y[todo]
+            x0, y0 = p[:, 0, 0], p[:, 0, 1]
+            x1, y1 = p[:, 1, 0], p[:, 1, 1]
+            x2, y2 = p[:, 2, 0], p[:, 2, 1]
+            det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+            det = np.where(det != 0, det, np.nan)
+            l0 = ((y1 - y2) * (px - x2) + (x2 - x1) * (py - y2)) / det
+            l1 = ((y2 - y0) * (px - x2) + (x0 - x2) * (py - y2)) / det
+            l2 = 1 - l0 - l1
+            hit = (l0 >= -EPS) & (l1 >= -EPS) & (l2 >= -EPS)
+            found[todo[hit]] = t[hit]
+        return found
+
+    def sample(self, x, y, slope = False, chunk = 1000000):
+        """TIN z (and slope in degrees) at points, NaN outside of the TIN."""
+        x = np.asarray(x, dtype = float)
+        y = np.asarray(y, dtype = float)
+        tri = np.empty(len(x), dtype = np.int64)
+        for s in range(0, len(x), chunk):
+            tri[s:s + chunk] = self.locate(x[s:s + chunk], y[s:s + chunk])
+        a, b, c = self.planes[np.maximum(tri, 0)].T
+        out = tri < 0
+        z = np.where(out, np.nan, a * x + b * y + c)
+        if not slope:
+            return z
+        deg = np.where(out, np.nan, np.degrees(np.arctan(np.hypot(a, b))))
+        return z, deg
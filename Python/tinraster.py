@@ -0,0 +1,221 @@
+############################################################################
+#
+# Scanline rasterization of TIN triangles (see tinarrays.py) for
+# <v.tin.to.rast>: triangles are visited instead of raster cells, the
+# cell centres inside the bounding box of every triangle are tested and
+# interpolated with barycentric weights, vectorized over groups of
+# triangles of similar size.
+#
+# Alexander Muriy (amuriy AT gmail DOT com)
+#
+############################################################################
+
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+# cells tested at once (memory of one vectorized step)
+CHUNK_CELLS = 1 << 22
+# tolerance of barycentric weights for cells on triangle edges
+EPS = 1e-9
+
+
+class Region(object):
+    """Raster grid (cell centres) of the current region."""
+
+    def __init__(self, north, west, nsres, ewres, rows, cols):
+        self.north = north
+        self.west = west
+        self.nsres = nsres
+        self.ewres = ewres
+        self.rows = rows
+        self.cols = cols
+
+
+def cell_ranges(nodes, ele, region):
+    """First and last row and column of cell centres in the bounding box
+    of every triangle (empty ranges have last < first)."""
+    p = nodes[ele]
+    xmin = p[:, :, 0].min(axis = 1)
+    xmax = p[:, :, 0].max(axis = 1)
+    ymin = p[:, :, 1].min(axis = 1)
+    ymax = p[:, :, 1].max(axis = 1)
+    c0 = np.ceil((xmin - region.west) / region.ewres - 0.5)
+    c1 = np.floor((xmax - region.west) / region.ewres - 0.5)
+    r0 = np.ceil((region.north - ymax) / region.nsres - 0.5)
+    r1 = np.floor((region.north - ymin) / region.nsres - 0.5)
+    c0 = np.clip(c0, 0, region.cols).astype(np.int64)
+    c1 = np.clip(c1, -1, region.cols - 1).astype(np.int64)
+    r0 = np.clip(r0, 0, region.rows).astype(np.int64)
+    r1 = np.clip(r1, -1, region.rows - 1).astype(np.int64)
+    return r0, r1, c0, c1
+
+
+def rasterize(nodes, ele, region, out, row0 = 0, tris = None, ranges = None,
+              tri_out = None, priority = None):
+    """Rasterize triangles into <out>, a buffer of rows
+    [row0, row0 + len(out)) of the region. Cells not covered by any
+    triangle keep their values. With <tri_out> (a buffer of the same
+    shape) the id of the triangle of every cell is stored as well.
+
+    With <priority> (one value per triangle, 0 is the highest) the
+    triangles of lower priority are drawn first and overwritten."""
+    if tris is None:
+        tris = np.arange(len(ele))
+    if ranges is None:
+        ranges = cell_ranges(nodes, ele, region)
+    if priority is not None:
+        level = priority[tris]
+        for p in np.unique(level)[::-1]:
+            rasterize(nodes, ele, region, out, row0, tris[level == p], ranges,
+                      tri_out)
+        return
+    r0, r1, c0, c1 = [r[tris] for r in ranges]
+    # clip to the rows of the buffer
+    r0 = np.maximum(r0, row0)
+    r1 = np.minimum(r1, row0 + len(out) - 1)
+    nrow = r1 - r0 + 1
+    ncol = c1 - c0 + 1
+    hit = (nrow > 0) & (ncol > 0)
+    tris, r0, c0, nrow, ncol = tris[hit], r0[hit], c0[hit], nrow[hit], ncol[hit]
+    if not len(tris):
+        return
+
+    # triangles grouped by size of their boxes (rounded to powers of 2)
+    hbin = np.ceil(np.log2(nrow)).astype(np.int64)
+    wbin = np.ceil(np.log2(ncol)).astype(np.int64)
+    group = hbin * 64 + wbin
+    order = np.argsort(group, kind = 'stable')
+    bounds = np.flatnonzero(np.r_[True, group[order][1:] != group[order][:-1], True])
+
+    for g in range(len(bounds) - 1):
+        sel = order[bounds[g]:bounds[g + 1]]
+        height = 1 << int(hbin[sel[0]])
+        width = 1 << int(wbin[sel[0]])
+        step = max(1, CHUNK_CELLS // (height * width))
+        for s in range(0, len(sel), step):
+            idx = sel[s:s + step]
+            _rasterize_group(nodes, ele, tris[idx], region, out, tri_out,
+                             row0, r0[idx], c0[idx], nrow[idx], ncol[idx],
+                             height, width)
+
+
+def _rasterize_group(nodes, ele, tris, region, out, tri_out, row0,
+                     r0, c0, nrow, ncol, height, width):
+    rr = r0[:, None, None] + np.arange(height)[None, :, None]
+    cc = c0[:, None, None] + np.arange(width)[None, None, :]
+    valid = ((rr - r0[:, None, None]) < nrow[:, None, None]) & \
+            ((cc - c0[:, None, None]) < ncol[:, None, None])
+    x = region.west + (cc + 0.5) * region.ewres
+    y = region.north - (rr + 0.5) * region.nsres
+
+    p = nodes[ele[tris]]
+    x0, y0, z0 = [p[:, 0, k][:, None, None] for k in range(3)]
+    x1, y1, z1 = [p[:, 1, k][:, None, None] for k in range(3)]
+    x2, y2, z2 = [p[:, 2, k][:, None, None] for k in range(3)]
+    det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+    det = np.where(det != 0, det, np.nan)
+    l0 = ((y1 - y2) * (x - x2) + (x2 - x1) * (y - y2)) / det
+    l1 = ((y2 - y0) * (x - x2) + (x0 - x2) * (y - y2)) / det
+    l2 = 1 - l0 - l1
+    inside = valid & (l0 >= -EPS) & (l1 >= -EPS) & (l2 >= -EPS)
+
+    z = l0 * z0 + l1 * z1 + l2 * z2
+    rr, cc = np.broadcast_arrays(rr, cc)
+    out[rr[inside] - row0, cc[inside]] = z[inside]
+    if tri_out is not None:
+        tid = np.broadcast_to(tris[:, None, None], inside.shape)
+        tri_out[rr[inside] - row0, cc[inside]] = tid[inside]
+
+
+def band_triangles(ranges, band_rows, nbands):
+    """Triangles of every band of <band_rows> rows, as CSR arrays:
+    band k holds tris[indptr[k]:indptr[k + 1]]."""
+    r0, r1, c0, c1 = ranges
+    idx = np.flatnonzero((r1 >= r0) & (c1 >= c0))
+    b0 = r0[idx] // band_rows
+    n = r1[idx] // band_rows - b0 + 1
+    tris = np.repeat(idx, n)
+    band = np.repeat(b0, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    order = np.argsort(band, kind = 'stable')
+    indptr = np.searchsorted(band[order], np.arange(nbands + 1))
+    return indptr, tris[order]
+
+
+## parallel rasterization ##
+
+_shared = {}
+
+
+def _init_worker(paths, region, with_tri):
+    # read-only arrays shared by all workers through memory-mapped files
+    for name, path in paths.items():
+        _shared[name] = np.load(path, mmap_mode = 'r')
+    _shared['region'] = region
+    _shared['with_tri'] = with_tri
+
+
+def _new_band(nrows, ncols, with_tri):
+    out = np.full((nrows, ncols), np.nan)
+    tri = -np.ones((nrows, ncols), dtype = np.int64) if with_tri else None
+    return out, tri
+
+
+def _band_worker(args):
+    band, row0, nrows = args
+    s = _shared
+    out, tri = _new_band(nrows, s['region'].cols, s['with_tri'])
+    tris = np.asarray(s['tris'][s['indptr'][band]:s['indptr'][band + 1]])
+    ranges = [s['r0'], s['r1'], s['c0'], s['c1']]
+    rasterize(s['nodes'], s['ele'], s['region'], out, row0, tris, ranges, tri,
+              s.get('priority'))
+    return out, tri
+
+
+def rasterize_bands(nodes, ele, region, band_rows, nprocs = 1, prefix = None,
+                    with_tri = False, priority = None):
+    """Rasterized bands of <band_rows> rows, north to south, as
+    (first row, z buffer, triangle id buffer or None) tuples.
+    Overlapping triangles are resolved by <priority> (see rasterize()).
+
+    With nprocs > 1 the bands are rasterized by worker processes reading
+    the triangle arrays from .npy files <prefix>_*.npy, while the caller
+    consumes the bands in order; at most 2 * nprocs bands are kept.
+    """
+    nbands = (region.rows + band_rows - 1) // band_rows
+    ranges = cell_ranges(nodes, ele, region)
+    indptr, tris = band_triangles(ranges, band_rows, nbands)
+    jobs = [(band, band * band_rows, min(band_rows, region.rows - band * band_rows))
+            for band in range(nbands)]
+
+    if nprocs <= 1:
+        for band, row0, nrows in jobs:
+            out, tri = _new_band(nrows, region.cols, with_tri)
+            rasterize(nodes, ele, region, out, row0,
+                      tris[indptr[band]:indptr[band + 1]], ranges, tri, priority)
+            yield (row0,) + (out, tri)
+        return
+
+    arrays = dict(nodes = nodes, ele = ele, indptr = indptr, tris = tris,
+                  r0 = ranges[0], r1 = ranges[1], c0 = ranges[2], c1 = ranges[3])
+    if priority is not None:
+        arrays['priority'] = priority
+    paths = {}
+    for name, arr in arrays.items():
+        paths[name] = '%s_%s.npy' % (prefix, name)
+        np.save(paths[name], arr)
+
+    pool = Pool(nprocs, _init_worker, (paths, region, with_tri))
+    try:
+        pending = deque()
+        for job in jobs:
+            pending.append((job[1], pool.apply_async(_band_worker, (job,))))
+            if len(pending) >= 2 * nprocs:
+                row0, res = pending.popleft()
+                yield (row0,) + res.get()
+        while pending:
+            row0, res = pending.popleft()
+            yield (row0,) + res.get()
+    finally:
+        pool.terminate()
@@ -46,6 +46,55 @@
 #%  description: Text file to dump neighbors' categories
 #%  gisprompt: new_file,file,output
 #%End
+#%Option
+#%  key: adjacency
+#%  type: string
+#%  required: no
+#%  key_desc: name
+#%  description: Directory to save the adjacency in CSR form as NumPy .npy files
+#%  gisprompt: new,dir,dir
+#%End
+#%Option
+#%  key: hops
+#%  type: integer
+#%  required: no
+#%  description: Find all nodes within this number of hops of every node
+#%End
+#%Option
+#%  key: max_cost
+#%  type: double
+#%  required: no
+#%  description: Find all nodes within this network distance (length of lines) of every node
+#%End
+#%Option
+#%  key: neighborhood
+#%  type: string
+#%  required: no
+#%  key_desc: name
+#%  description: Directory to save the neighborhoods of hops= or max_cost= in CSR form as NumPy .npy files
+#%  gisprompt: new,dir,dir
+#%End
+#%Option
+#%  key: column
+#%  type: string
+#%  required: no
+#%  description: Column (layer 2) for the neighborhoods of hops= or max_cost=
+#%End
+#%Option
+#%  key: snap
+#%  type: double
+#%  required: no
+#%  description: Snapping tolerance of nodes to line ends (in map units)
+#%  answer: 0
+#%End
+#%Option
+#%  key: state
+#%  type: string
+#%  required: no
+#%  key_desc: name
+#%  description: State file of the previous run: if it exists, only neighbors of nodes affected by edits are recomputed and updated; it is rewritten after the run
+#%  gisprompt: new_file,file,output
+#%End
 #%Flag
 #%  key: i
 #%  description: Use only nodes on lines' intersections
@@ -55,10 +104,33 @@
 #%  description: Just print neighbors' categories for every node
 #%End
 ############################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+# Neighbors of a node are all nodes on the start or end points of the
+# lines which start or end at it; nodes closer than snap= to a line end
+# are on it.
+#
+# The adjacency directory holds arrays cats.npy (node categories),
+# indptr.npy and indices.npy: the neighbors of node cats[k] are
+# cats[indices[indptr[k]:indptr[k + 1]]], and for every neighbor the
+# lengths.npy and line_cats.npy of the (shortest) line joining them.
+# Every array can be memory-mapped with np.load(path, mmap_mode = 'r').
+#
+# The neighborhood directory has the same form, with costs.npy (number
+# of hops or network distance) instead of lengths and line cats.
+#
+# The state file holds the nodes, the hashes of line geometries and the
+# adjacency of the run. Neighbors are recomputed only for added, removed
+# and moved nodes, their old and new neighbors, and nodes on added,
+# removed or moved lines; only their rows of neigh_node are updated.
+# The state also records whether neigh_node matches it: after a run
+# with -p it may not, and the next run without -p updates all rows.
+#
+############################################################################
 
 import sys,os
-import shutil
-import atexit
 
 try:
     import grass.script as grass
@@ -66,26 +138,81 @@ except:
     try:
         from grass.script import core as grass
     except:
-        if not os.environ.has_key("GISBASE"):
-            print "You must be in GRASS GIS to run this program."
+        if "GISBASE" not in os.environ:
+            print("You must be in GRASS GIS to run this program.")
             sys.exit(1)
 
-        
-def cleanup():
-    nuldev = file(os.devnull, 'w')
-    grass.run_command('g.mremove', vect = 'v_net_neighbors_*', flags = 'f',
-                      quiet = True, stderr = nuldev)
+import numpy as np
+
+from grass.lib.gis import G_gisinit
+from grass.lib.vector import GV_LINE, GV_BOUNDARY
+
+from netgraph import (read_network, snap_ends, point_neighbours, hop_neighbourhood,
+                      cost_neighbourhood, csr_from_pairs, affected_points)
+
+
+def csr_lists(cats, indptr, indices):
+    """Comma-joined categories of the neighbors of every node, by cat."""
+    out_dict = {}
+    for k in np.argsort(cats, kind = 'stable'):
+        out_dict[int(cats[k])] = ','.join(str(c) for c in cats[indices[indptr[k]:indptr[k + 1]]])
+    return out_dict
+
+
+def save_arrays(path, **arrays):
+    """Arrays as <name>.npy files in directory <path>."""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), arr)
+
+
+def load_state(path, snap, only_inter):
+    """Arrays of the previous run, None if there is none or if it was
+    made with other settings."""
+    if not path or not os.path.exists(path):
+        return None
+    old = dict(np.load(path))
+    if float(old['snap']) != snap or bool(old['only_inter']) != only_inter:
+        grass.warning(_("State file <%s> was made with other snap or -i, "
+                        "recomputing all neighbors") % path)
+        return None
+    return old
+
+
+def cat_index(cats, values):
+    # positions of categories <values> in <cats>
+    order = np.argsort(cats, kind = 'stable')
+    return order[np.searchsorted(cats[order], values)]
+
+
+def update_column(f, column, out_dict):
+    sql = ['BEGIN TRANSACTION;']
+    for cat, val in out_dict.items():
+        sql.append("UPDATE %s SET %s = '%s' WHERE %s = %d;" % (f['table'], column, val, f['key'], cat))
+    sql.append('COMMIT;')
+    grass.write_command('db.execute', input_ = '-', database = f['database'],
+                        driver = f['driver'], stdin = '\n'.join(sql))
+
     
 def main():
-    global tmp, nuldev
-    nuldev = file(os.devnull, 'w')
-
-    ## setup temporary files
-    tmp = grass.tempfile()
-    tmpf = 'v_net_neighbors'
+    global nuldev
+    nuldev = open(os.devnull, 'w')
 
     inmap = options['input']
     outfile = options['dump']
+    adjacency = options['adjacency']
+    hops = int(options['hops'] or 0)
+    max_cost = float(options['max_cost']) if options['max_cost'] else None
+    hood_file = options['neighborhood']
+    hood_column = options['column']
+    snap = float(options['snap'] or 0)
+    state = options['state']
+
+    if hops and max_cost is not None:
+        grass.fatal(_("Options <hops> and <max_cost> are mutually exclusive"))
+    if (hood_file or hood_column) and not (hops or max_cost is not None):
+        grass.fatal(_("Option <hops> or <max_cost> is required for the neighborhoods"))
 
     # check if input file exists
     if not grass.find_file(inmap, element = 'vector')['file']:
@@ -95,114 +222,133 @@ def main():
     try:
         f = grass.vector_db(inmap)[2]
     except KeyError:
-        grass.run_command('v.db.addtable', _map = inmap, layer = 2,
+        grass.run_command('v.db.addtable', map_ = inmap, layer = 2,
                           quiet = True, stderr = nuldev)
+        f = grass.vector_db(inmap)[2]
         
-    ## extract temp nodes and lines
-    nodes = tmpf + '_nodes'
-    lines = tmpf + '_lines'
-
     iflines = grass.vector_info_topo(inmap)['lines']
     ifbounds = grass.vector_info_topo(inmap)['boundaries']
     if iflines != 0:
-        vect_type = 'line'
+        vect_type = GV_LINE
     if ifbounds != 0:
-        vect_type = 'boundary'
+        vect_type = GV_BOUNDARY
     
     if iflines != 0 and ifbounds != 0:
         grass.fatal(_("Input net vector map must have lines OR boundaries, not both"))
 
-    grass.run_command('v.extract', input = inmap, output = nodes, layer = 2, 
-                      _type = 'point', flags = 't', quiet = True, stderr = nuldev)
-    grass.run_command('v.extract', input = inmap, output = lines,  
-                      _type = vect_type, flags = 't', quiet = True, stderr = nuldev)
+    ## read nodes and lines in one pass over the topology
+    G_gisinit('')
+    net = read_network(inmap, vect_type)
+    cats = net.point_cat
+    xy = net.point_xy
+
+    ## nodes on line ends (within snapping tolerance) in one lookup pass
+    pt, end = snap_ends(net.point_xy, net.line_ends, snap)
 
     ## filter nodes on line intersections if with '-i' flag 
     if flags['i']:
-        p = grass.pipe_command('v.net', _input = inmap, operation = 'nreport',
-                               quiet = True, stderr = nuldev)
-        c  = p.communicate()[0].strip().split('\n')
-        filt = [elem for elem in c if ',' in elem]
+        inc = np.unique(pt * len(net.line_id) + end // 2)
+        degree = np.bincount(inc // len(net.line_id), minlength = len(cats))
+        keep = degree > 1
+        new_index = np.cumsum(keep) - 1
+        sel = keep[pt]
+        pt, end = new_index[pt[sel]], end[sel]
+        cats = cats[keep]
+        xy = xy[keep]
+    inc_cat = cats[pt]
+    inc_hash = net.line_hash[end // 2]
 
-        fnodes = []
-        
-        for x in filt:
-            spl = x.split(' ')
-            fnodes.append(spl[0])
+    ## nodes affected by edits since the previous run (all without state)
+    old = load_state(state, snap, flags['i'])
+    if old is None:
+        affected = np.ones(len(cats), dtype = bool)
+    else:
+        affected = np.isin(cats, affected_points(old, cats, xy, net.line_hash,
+                                                 inc_cat, inc_hash))
+        grass.message(_("Recomputing neighbors of %d of %d nodes...") %
+                      (affected.sum(), len(cats)))
 
-        fnodes_str = ','.join(fnodes)
-        
-        nsel = tmpf + '_nsel'
-        grass.run_command('v.extract', _input = nodes, _list = fnodes_str, 
-                          output = nsel, layer = 2, _type = 'point',
-                          quiet = True, stderr = nuldev)
+    ## neighbors of all affected nodes at once, from the lines at them
+    sub = np.isin(end // 2, end[affected[pt]] // 2)
+    indptr, indices, lines, same = point_neighbours(pt[sub], end[sub], len(cats),
+                                                    net.line_length)
+    # length of the line joining neighbors, 0 at the same line end
+    lengths = np.where(same, 0.0, net.line_length[lines])
+    line_cats = net.line_cat[lines]
 
-        grass.run_command('g.rename', vect = (nsel,nodes), overwrite = True, 
-                          quiet = True, stderr = nuldev)
-        
-        
-    if not flags['p']:
-        grass.run_command('v.db.addcol', _map = inmap, layer = 2, 
-                          columns = 'neigh_node varchar(255)', 
-                          quiet = True, stderr = nuldev)
+    if old is not None:
+        # new rows of affected nodes, rows of the previous run for the others
+        rows = np.repeat(np.arange(len(cats)), np.diff(indptr))
+        new = affected[rows]
+        old_rows = np.repeat(old['point_cat'], np.diff(old['adj_indptr']))
+        kept = np.isin(old_rows, cats[~affected])
+        rows = np.concatenate([rows[new], cat_index(cats, old_rows[kept])])
+        cols = np.concatenate([indices[new], cat_index(cats, old['adj_cats'][kept])])
+        lengths = np.concatenate([lengths[new], old['adj_lengths'][kept]])
+        line_cats = np.concatenate([line_cats[new], old['adj_line_cats'][kept]])
+        indptr, indices, order = csr_from_pairs(rows, cols, np.arange(len(rows)), len(cats))
+        lengths = lengths[order]
+        line_cats = line_cats[order]
+    out_dict = csr_lists(cats, indptr, indices)
 
-    ## main cycle (extract every node and make 2 selects)
-    out_dict = {}
+    if adjacency:
+        save_arrays(adjacency, cats = cats, indptr = indptr, indices = indices,
+                    lengths = lengths, line_cats = line_cats)
 
-    p = grass.pipe_command('v.category', _input = nodes, opt = 'print', layer = 2, 
-                           _type = 'point', quiet = True, stderr = nuldev)
-    c = p.communicate()[0].strip().split('\n')
-    for cat in c:
-        icat = int(cat)
-
-        nnode = nodes + cat
-        grass.run_command('v.extract', _input = nodes, _list = cat, 
-                          output = nnode, layer = 2, _type = 'point',
-                          flags = 't', quiet = True, stderr = nuldev)
-
-        linode = nnode + '_lines'
-        grass.run_command('v.select', ain = lines, _bin = nnode, 
-                          blayer = 2, output = linode, 
-                          operator = 'overlap', quiet = True, stderr = nuldev)
-        
-        linode_pts = linode + '_pts'
-        grass.run_command('v.select', ain = nodes, alayer = 2, 
-                          _bin = linode, output = linode_pts, 
-                          operator = 'overlap', quiet = True, stderr = nuldev)
-        
-        pcat = grass.pipe_command('v.category', _input = linode_pts, layer = 2,
-                                  opt = 'print', quiet = True, stderr = nuldev)
-        ccat = pcat.communicate()[0].strip().split('\n')
-        ccat.remove(cat)
-        
-        ncat_list = []
-        ncat_list.append(ccat)
+    # neigh_node matches the state if written now, or if it matched the
+    # previous one and no node was affected; states without the field
+    # are taken as not matching
+    column_done = old is not None and bool(old.get('column_done', False))
+    if state:
+        with open(state, 'wb') as fout:
+            np.savez(fout, snap = snap, only_inter = flags['i'],
+                     point_cat = cats, point_xy = xy, line_hash = net.line_hash,
+                     inc_cat = inc_cat, inc_hash = inc_hash, adj_indptr = indptr,
+                     adj_cats = cats[indices], adj_lengths = lengths,
+                     adj_line_cats = line_cats,
+                     column_done = not flags['p'] or (column_done and not affected.any()))
 
-        str_db = ','.join(map(str, ncat_list))
-        str_db1 = str_db.replace("[", "").replace("]", "").replace("'", "").replace(" ", "")
+    if not flags['p']:
+        long_lists = sum(len(val) > 255 for val in out_dict.values())
+        if long_lists:
+            grass.warning(_("Neighbors of %d nodes are longer than 255 characters "
+                            "and truncated in column <neigh_node> (see adjacency=)") % long_lists)
+        if 'neigh_node' not in grass.vector_columns(inmap, layer = 2):
+            grass.run_command('v.db.addcolumn', map_ = inmap, layer = 2, 
+                              columns = 'neigh_node varchar(255)', 
+                              quiet = True, stderr = nuldev)
+            column_done = False
+        update_column(f, 'neigh_node',
+                      dict((int(cat), out_dict[cat] if len(out_dict[cat]) <= 255
+                            else out_dict[cat][:256].rsplit(',', 1)[0])
+                           for cat in (cats[affected] if column_done else cats)))
 
-        out_dict[icat] = str_db1
-        
-        if not flags['p']:
-            grass.run_command('v.db.update', _map = inmap, layer = 2, 
-                              column = 'neigh_node', value = '%s' % (str_db1), 
-                              where = "cat = %d" % (icat), 
-                              quiet = True, stderr = nuldev )
+    ## k-hop or network distance neighborhoods over the adjacency
+    if hops or max_cost is not None:
+        if hops:
+            grass.message(_("Finding neighborhoods of %d hops...") % hops)
+            hood = hop_neighbourhood(indptr, indices, hops)
+        else:
+            grass.message(_("Finding neighborhoods within distance %g...") % max_cost)
+            hood = cost_neighbourhood(indptr, indices, lengths, max_cost)
+        if hood_file:
+            save_arrays(hood_file, cats = cats, indptr = hood[0], indices = hood[1],
+                        costs = hood[2])
+        if hood_column and not flags['p']:
+            if hood_column not in grass.vector_columns(inmap, layer = 2):
+                grass.run_command('v.db.addcolumn', map_ = inmap, layer = 2,
+                                  columns = '%s text' % hood_column,
+                                  quiet = True, stderr = nuldev)
+            update_column(f, hood_column, csr_lists(cats, hood[0], hood[1]))
         
     ## output to stdout / file
-    tmp3 = tmp + '.out'
-    outf2 = file(tmp3, 'w')
-    for key in sorted(out_dict.iterkeys()):
-        val = out_dict[key]
-        print >> outf2, "%s %s" % (key,val)
-    outf2.close()
-    
+    out = ''.join("%s %s\n" % (cat, val) for cat, val in out_dict.items())
     if flags['p']:
-        with open(tmp3, 'rb') as f:
-            print f.read()
+        sys.stdout.write(out)
 
     if outfile:
-        shutil.copyfile(tmp3, outfile)
+        with open(outfile, 'w') as fout:
+            fout.write(out)
                 
 
     return 0
@@ -210,5 +356,4 @@ def main():
 
 if __name__ == "__main__":
     options, flags = grass.parser()
-    atexit.register(cleanup)
-    main()
+    sys.exit(main())
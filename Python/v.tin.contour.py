@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# MODULE:       v.tin.contour
+# AUTHOR(S):    Alexander Muriy
+#               e-mail: amuriy AT gmail DOT com
+#
+# PURPOSE:      Produces contour lines directly from a TIN
+#               (made by <v.triangle>) with "marching triangles",
+#               without rasterization of the TIN.
+#
+# COPYRIGHT:    (C) 2026 Alexander Muriy / GRASS Development Team
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+############################################################################
+#%Module
+#%  description: Produces contour lines directly from a TIN (made by <v.triangle>).
+#%  keywords: vector, TIN, contours, surface
+#%End
+#%Option
+#%  key: input
+#%  type: string
+#%  required: yes
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of input TIN map
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
+#%  key: output
+#%  type: string
+#%  required: yes
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of output vector map with contour lines
+#%  gisprompt: new,vector,vector
+#%End
+#%Option
+#%  key: levels
+#%  type: double
+#%  required: no
+#%  multiple: yes
+#%  description: List of contour levels
+#%End
+#%Option
+#%  key: minlevel
+#%  type: double
+#%  required: no
+#%  multiple: no
+#%  description: Minimum contour level
+#%End
+#%Option
+#%  key: maxlevel
+#%  type: double
+#%  required: no
+#%  multiple: no
+#%  description: Maximum contour level
+#%End
+#%Option
+#%  key: step
+#%  type: double
+#%  required: no
+#%  multiple: no
+#%  description: Increment between contour levels
+#%End
+###########################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+###########################################################################
+
+import sys
+import math
+
+import numpy as np
+
+import grass.script as grass
+from grass.lib.gis import G_gisinit
+from grass.pygrass.vector import VectorTopo
+from grass.pygrass.vector.geometry import Line
+
+from tinarrays import load_tin
+from tincontour import contour_segments, chain_segments, drop_repeated
+
+
+def main():
+    in_tin = options['input']
+    out_map = options['output']
+    levels = options['levels']
+    minlevel = options['minlevel']
+    maxlevel = options['maxlevel']
+    step = options['step']
+
+    if not levels and not step:
+        grass.fatal(_("Use <levels> or <step> option"))
+
+    # check if input map exists
+    if not grass.find_file(in_tin, element = 'vector')['file']:
+        grass.fatal(_("<%s> does not exist.") % in_tin)
+
+    ## initialize GRASS Ctypes library
+    G_gisinit('')
+    grass.message(_("Reading TIN..."))
+    nodes, ele, neigh = load_tin(in_tin)
+    if not len(ele):
+        grass.fatal(_("No triangles found in <%s>") % in_tin)
+
+    zmin = nodes[:, 2].min()
+    zmax = nodes[:, 2].max()
+    if levels:
+        levels = np.unique([float(l) for l in levels.split(',')])
+    else:
+        step = float(step)
+        if step <= 0:
+            grass.fatal(_("Option <step> must be positive"))
+        lmin = float(minlevel) if minlevel else math.ceil(zmin / step) * step
+        lmax = float(maxlevel) if maxlevel else zmax
+        levels = np.arange(lmin, lmax + step * 0.5, step)
+    levels = levels[(levels >= zmin) & (levels <= zmax)]
+    if not len(levels):
+        grass.fatal(_("No contour levels within TIN range %s..%s") % (zmin, zmax))
+
+    grass.message(_("Computing contours for %d levels...") % len(levels))
+    xy, lev, segments = contour_segments(nodes, ele, levels)
+    lines = drop_repeated(xy, chain_segments(len(xy), segments))
+
+    grass.message(_("Writing %d contour lines...") % len(lines))
+    cols = [(u'cat', 'INTEGER PRIMARY KEY'), (u'level', 'DOUBLE PRECISION')]
+    new = VectorTopo(out_map)
+    new.open('w', tab_cols = cols, overwrite = grass.overwrite())
+    for cat, line in enumerate(lines, 1):
+        new.write(Line(xy[line].tolist()), cat = cat,
+                  attrs = (float(levels[lev[line[0]]]),))
+    new.table.conn.commit()
+    new.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    options, flags = grass.parser()
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# MODULE:       v.tin.sample
+# AUTHOR(S):    Alexander Muriy
+#               e-mail: amuriy AT gmail DOT com
+#
+# PURPOSE:      Samples a TIN (made by <v.triangle>) at the points of
+#               a vector map and uploads TIN elevation (and optionally
+#               slope) to the attribute table of the points.
+#
+# COPYRIGHT:    (C) 2026 Alexander Muriy / GRASS Development Team
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+############################################################################
+#%Module
+#%  description: Samples a TIN at the points of a vector map and uploads elevation (and slope) to its attribute table.
+#%  keywords: vector, TIN, sampling, surface
+#%End
+#%Option
+#%  key: tin
+#%  type: string
+#%  required: yes
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of input TIN map
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
+#%  key: points
+#%  type: string
+#%  required: yes
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of vector map with points to sample
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
+#%  key: column
+#%  type: string
+#%  required: no
+#%  multiple: no
+#%  description: Column for TIN elevation
+#%  answer: tin_z
+#%End
+#%Option
+#%  key: slope_column
+#%  type: string
+#%  required: no
+#%  multiple: no
+#%  description: Column for TIN slope (in degrees)
+#%End
+###########################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+###########################################################################
+
+import sys
+import io
+
+import numpy as np
+
+import grass.script as grass
+from grass.lib.gis import G_gisinit
+
+from tinarrays import load_tin
+from tinindex import TinIndex
+
+
+def main():
+    in_tin = options['tin']
+    in_pts = options['points']
+    column = options['column']
+    slope_column = options['slope_column']
+
+    global nuldev
+    nuldev = None
+
+    # check if input maps are existed
+    if not grass.find_file(in_tin, element = 'vector')['file']:
+        grass.fatal(_("<%s> does not exist.") % in_tin)
+    if grass.find_file(in_pts, element = 'vector')['mapset'] != grass.gisenv()['MAPSET']:
+        grass.fatal(_("Vector map <%s> not found in the current mapset") % in_pts)
+
+    # check for table in points map
+    try:
+        db = grass.vector_db(in_pts)[1]
+    except KeyError:
+        grass.run_command('v.db.addtable', map_ = in_pts, quiet = True, stderr = nuldev)
+        db = grass.vector_db(in_pts)[1]
+
+    ## initialize GRASS Ctypes library
+    G_gisinit('')
+    grass.message(_("Indexing TIN triangles..."))
+    nodes, ele, neigh = load_tin(in_tin)
+    index = TinIndex(nodes, ele)
+
+    ## points: x, y, [z,] cat
+    asc = grass.read_command('v.out.ascii', input_ = in_pts, format_ = 'point',
+                             type_ = 'point', sep = ' ', quiet = True)
+    pts = np.loadtxt(io.StringIO(asc), ndmin = 2)
+    if not len(pts):
+        grass.fatal(_("No points found in <%s>") % in_pts)
+    cats = pts[:, -1].astype(np.int64)
+
+    grass.message(_("Sampling %d points...") % len(pts))
+    z, slope = index.sample(pts[:, 0], pts[:, 1], slope = True)
+    grass.message(_("%d points are outside of the TIN") % np.isnan(z).sum())
+
+    ## upload to the attribute table
+    values = [(column, z)]
+    if slope_column:
+        values.append((slope_column, slope))
+    existing = grass.vector_columns(in_pts)
+    new_cols = ['%s double precision' % col for col, v in values if col not in existing]
+    if new_cols:
+        grass.run_command('v.db.addcolumn', map_ = in_pts, columns = ','.join(new_cols),
+                          quiet = True, stderr = nuldev)
+
+    sql = ['BEGIN TRANSACTION;']
+    for k, cat in enumerate(cats):
+        sets = ', '.join('%s = %s' % (col, 'NULL' if np.isnan(v[k]) else repr(float(v[k])))
+                         for col, v in values)
+        sql.append("UPDATE %s SET %s WHERE %s = %d;" % (db['table'], sets, db['key'], cat))
+    sql.append('COMMIT;')
+    grass.write_command('db.execute', input_ = '-', database = db['database'],
+                        driver = db['driver'], stdin = '\n'.join(sql))
+
+    return 0
+
+
+if __name__ == "__main__":
+    options, flags = grass.parser()
+    sys.exit(main())
@@ -30,16 +30,60 @@
 #% keywords: raster
 #% keywords: conversion
 #%end
-#%option G_OPT_V_INPUT
-#% label: Name of input TIN map
-#% description: Name of input TIN map
+#%option G_OPT_V_INPUTS
+#% label: Name of input TIN map(s)
+#% description: Overlapping TINs are resolved by priority, the first map is the highest
 #%end
 #%option G_OPT_R_OUTPUT
 #%end
+#%option G_OPT_R_OUTPUT
+#% key: slope
+#% description: Name for output slope raster map (degrees)
+#% required: no
+#%end
+#%option G_OPT_R_OUTPUT
+#% key: aspect
+#% description: Name for output aspect raster map (degrees counterclockwise from east)
+#% required: no
+#%end
+#%option G_OPT_R_OUTPUT
+#% key: dx
+#% description: Name for output E-W slope raster map (dz/dx)
+#% required: no
+#%end
+#%option G_OPT_R_OUTPUT
+#% key: dy
+#% description: Name for output N-S slope raster map (dz/dy)
+#% required: no
+#%end
+#%option
+#% key: memory
+#% type: integer
+#% description: Maximum memory for raster rows (in MB)
+#% answer: 300
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of processes for rasterization
+#% answer: 1
+#% required: no
+#%end
+############################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+# Gradients are exact per triangle: dx = dz/dx (east), dy = dz/dy (north),
+# slope in degrees, aspect in degrees counterclockwise from east
+# (0 for flat triangles).
+#
 ############################################################################
 
 import sys
 import os
+import glob
 import atexit
 
 try:
@@ -48,8 +92,8 @@ except:
     try:
         from grass.script import core as grass
     except:
-        if not os.environ.has_key("GISBASE"):
-            print "You must be in GRASS GIS to run this program."
+        if "GISBASE" not in os.environ:
+            print("You must be in GRASS GIS to run this program.")
             sys.exit(1)
 
 grass_version = grass.version().get('version')[0:2]
@@ -60,123 +104,144 @@ else:
     from grass.lib.vector import *
     from grass.lib.raster import *
 
+import numpy as np
+
+from tinarrays import load_tin, plane_coefficients
+from tinraster import Region, rasterize_bands
+
 def cleanup():
-    nuldev = file(os.devnull, 'w')
-    if tmp:
-        grass.run_command('g.remove', type = 'raster',
-                          name = '%s' % tmp,
-                          quiet = True, stderr = nuldev)
+    nuldev = open(os.devnull, 'w')
+    for f in glob.glob(tmpfile + '*'):
+        grass.try_remove(f)
 
 def main():
     
-    global nuldev, tmp
-    nuldev = file(os.devnull, 'w')
-    tmp = "v_tin_to_rast_%d" % os.getpid()
+    global nuldev, tmpfile
+    nuldev = open(os.devnull, 'w')
+    tmpfile = grass.tempfile()
 
 
-    input = options['input']
+    inputs = options['input'].split(',')
     output = options['output']
+    memory = int(options['memory'])
+    nprocs = int(options['nprocs'])
+    grad_maps = [(name, options[name]) for name in ('slope', 'aspect', 'dx', 'dy')
+                 if options[name]]
     
     # initialize GRASS library
     G_gisinit('')
 
-    # check if vector map exists
-    mapset = G_find_vector2(input, "")
-    if not mapset:
-        grass.fatal("Vector map <%s> not found" % input)x
+    for input in inputs:
+        # check if vector map exists
+        mapset = G_find_vector2(input, "")
+        if not mapset:
+            grass.fatal("Vector map <%s> not found" % input)
 
-    # define map structure 
-    map_info = pointer(Map_info())
-    
-    # set vector topology to level 2 
-    Vect_set_open_level(2)
+        # define map structure 
+        map_info = pointer(Map_info())
 
-    # opens the vector map
-    Vect_open_old(map_info, input, mapset)
+        # set vector topology to level 2 
+        Vect_set_open_level(2)
 
-    Vect_maptype_info(map_info, input, mapset)
-    
-    # check if vector map is 3D
-    if Vect_is_3d(map_info):
-        grass.message("Vector map <%s> is 3D" % input)
-    else:
-        grass.fatal("Vector map <%s> is not 3D" % input)
+        # opens the vector map
+        Vect_open_old(map_info, input, mapset)
+
+        Vect_maptype_info(map_info, input, mapset)
+
+        # check if vector map is 3D
+        if Vect_is_3d(map_info):
+            grass.message("Vector map <%s> is 3D" % input)
+        else:
+            grass.fatal("Vector map <%s> is not 3D" % input)
+
+        # close vector
+        Vect_close(map_info)
 
-    # allocation of the output buffer using the values of the current region
+    # current region
     window = pointer(Cell_head())
     G_get_window(window)
     nrows = window.contents.rows
     ncols = window.contents.cols
-    xref = window.contents.west
-    yref = window.contents.south
-    xres = window.contents.ew_res
-    yres = window.contents.ns_res
-
-    outrast = []
-    for i in range(nrows):
-        outrast[i:] = [Rast_allocate_d_buf()]
-    
+    region = Region(window.contents.north, window.contents.west,
+                    window.contents.ns_res, window.contents.ew_res,
+                    nrows, ncols)
+
     # create new raster
     outfd = Rast_open_new(output, DCELL_TYPE)
     if outfd < 0:
         grass.fatal("Impossible to create a raster <%s>" % output)
-        
-    # insert null values in cells
-    grass.message(_("Step 1/4: Inserting null values in cells..."))
-    for i in range(nrows):
-        Rast_set_d_null_value(outrast[i], ncols)
-        G_percent(i, nrows, 2)
+    gradfd = []
+    for name, mapname in grad_maps:
+        fd = Rast_open_new(mapname, FCELL_TYPE)
+        if fd < 0:
+            grass.fatal("Impossible to create a raster <%s>" % mapname)
+        gradfd.append((name, fd))
 
     #####  main work #####
-    grass.message(_("Step 2/4: TIN preprocessing..."))
-    z = c_double()
-    G_percent(0, nrows, 2)
-    Vect_tin_get_z(map_info, xref, yref, byref(z), None, None)
-
-    grass.message(_("Step 3/4: Converting TIN to raster..."))
-    for i in range(nrows):
-        for j in range(ncols):
-            x = xref + j * xres
-            y = yref + i * yres
-            Vect_tin_get_z(map_info, x, y, byref(z), None, None)
-            outrast[i][j] = z
-        G_percent(i, nrows, 2)
-
-    grass.message(_("Step 4/4: Writing raster map..."))
-
-    for i in range(nrows - 1, -1, -1):
-        Rast_put_d_row(outfd, outrast[i])
-        G_percent(nrows - i, nrows, 2)
-        
-    # clear buffer
-    for i in range(nrows):
-        G_free(outrast[i])
+    grass.message(_("Step 1/2: Reading TIN triangles..."))
+    # all TINs in one set of arrays (triangle ids are global), with the
+    # priority of every triangle given by the order of the input maps
+    all_nodes, all_ele, all_prio = [], [], []
+    nnodes = 0
+    for k, input in enumerate(inputs):
+        nodes, ele, neigh = load_tin(input)
+        all_nodes.append(nodes)
+        all_ele.append(ele + nnodes)
+        all_prio.append(np.full(len(ele), k))
+        nnodes += len(nodes)
+    nodes = np.concatenate(all_nodes)
+    ele = np.concatenate(all_ele)
+    priority = np.concatenate(all_prio) if len(inputs) > 1 else None
+
+    # exact gradients from the triangle planes z = a * x + b * y + c
+    if grad_maps:
+        planes = plane_coefficients(nodes, ele)
+        a, b = planes[:, 0], planes[:, 1]
+        grads = {'dx': a, 'dy': b,
+                 'slope': np.degrees(np.arctan(np.hypot(a, b)))}
+        # downslope direction, counterclockwise from east, 0 for flat
+        aspect = np.degrees(np.arctan2(-b, -a))
+        aspect = np.where(aspect <= 0, aspect + 360, aspect)
+        grads['aspect'] = np.where((a == 0) & (b == 0), 0, aspect)
+
+    # triangles bucketed by bands of rows, which are rasterized
+    # and written north to south; cells outside of the TIN are not
+    # covered by any triangle and stay null (NaN is the null value of DCELL)
+    # a band row costs its z buffer (DCELL) and, for gradients, its
+    # triangle id buffer (int64); gradients are written row by row from
+    # the triangle ids. One band is in memory, or with nprocs > 1 one
+    # per worker plus 2 per worker queued and one being unpickled.
+    nbands = 1 if nprocs <= 1 else 3 * nprocs + 1
+    row_bytes = ncols * (8 + (8 if grad_maps else 0)) * nbands
+    band_rows = max(1, min(nrows, memory * 1024 * 1024 // row_bytes))
+
+    grass.message(_("Step 2/2: Converting TIN to raster..."))
+    for row0, outrast, tri in rasterize_bands(nodes, ele, region, band_rows,
+                                              nprocs, tmpfile, bool(grad_maps),
+                                              priority):
+        for row in outrast:
+            Rast_put_d_row(outfd, row.ctypes.data_as(POINTER(DCELL)))
+        for name, fd in gradfd:
+            for trow in tri:
+                row = np.where(trow >= 0, grads[name][np.maximum(trow, 0)], np.nan)
+                Rast_put_d_row(fd, row.ctypes.data_as(POINTER(DCELL)))
+        G_percent(row0 + len(outrast), nrows, 2)
 
     # close raster
     Rast_close(outfd)
-
-    # close vector
-    Vect_close(map_info)
-    
-    # cut output raster to TIN vertical range
-    vtop = grass.read_command('v.info', flags = 'g',
-                              map = input).rsplit()[4].split('=')[1]
-    vbottom = grass.read_command('v.info', flags = 'g',
-                                 map = input).rsplit()[5].split('=')[1]
-
-    tmp = "v_tin_to_rast_%d" % os.getpid()
-    grass.mapcalc("$tmp = if($vbottom < $output && $output < $vtop, $output, null())",
-                  tmp = tmp, output = output, vbottom = vbottom, vtop = vtop,
-                  quiet = True, stderr = nuldev)
-
-    grass.parse_command('g.rename', rast = (tmp, output),
-                      quiet = True, stderr = nuldev)
+    for name, fd in gradfd:
+        Rast_close(fd)
 
     # write cmd history:
     grass.run_command('r.support', map = output,
                       title = "%s" % output, history="", 
                       description = "generated by v.tin.to.rast")
     grass.raster_history(output)
+    for name, mapname in grad_maps:
+        grass.run_command('r.support', map = mapname,
+                          title = "%s" % mapname, history="",
+                          description = "%s generated by v.tin.to.rast" % name)
+        grass.raster_history(mapname)
 
     grass.message(_("Done."))
 
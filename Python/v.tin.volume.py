@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# MODULE:       v.tin.volume
+# AUTHOR(S):    Alexander Muriy
+#               e-mail: amuriy AT gmail DOT com
+#
+# PURPOSE:      Computes exact cut and fill volumes and areas between
+#               two TINs (made by <v.triangle>), optionally per polygon
+#               zone, by overlay of the triangulations (no rasterization).
+#
+# COPYRIGHT:    (C) 2026 Alexander Muriy / GRASS Development Team
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+############################################################################
+#%Module
+#%  description: Computes exact cut and fill volumes and areas between two TINs, optionally per polygon zone.
+#%  keywords: vector, TIN, volume, earthworks
+#%End
+#%Option
+#%  key: before
+#%  type: string
+#%  required: yes
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of input TIN map of the earlier surface
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
+#%  key: after
+#%  type: string
+#%  required: yes
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of input TIN map of the later surface
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
+#%  key: zones
+#%  type: string
+#%  required: no
+#%  multiple: no
+#%  key_desc: name
+#%  description: Name of vector map with polygon zones (volumes are uploaded to its table)
+#%  gisprompt: old,vector,vector
+#%End
+#%Flag
+#%  key: p
+#%  description: Just print volumes and areas (do not update the zones table)
+#%End
+###########################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
+# Fill is where the later surface is above the earlier one, cut is
+# where it is below. Volumes are in cubic map units.
+#
+###########################################################################
+
+import sys
+
+import numpy as np
+
+import grass.script as grass
+from grass.lib.gis import G_gisinit
+from grass.pygrass.vector import VectorTopo
+
+from tinarrays import load_tin, plane_coefficients, triangle_boxes, box_pairs
+from polyclip import clip_halfplane, clip_convex, area_centroid
+
+
+def pad(poly, width):
+    if poly.shape[1] >= width:
+        return poly
+    fill = np.zeros((len(poly), width - poly.shape[1], 2))
+    return np.concatenate([poly, fill], axis = 1)
+
+
+def overlay(tin1, tin2, chunk = 200000):
+    """Convex pieces of the overlay of two TINs with the planes of the
+    difference surface (later minus earlier) on every piece."""
+    nodes1, ele1 = tin1[:2]
+    nodes2, ele2 = tin2[:2]
+    plane1 = plane_coefficients(nodes1, ele1)
+    plane2 = plane_coefficients(nodes2, ele2)
+    box1 = triangle_boxes(nodes1, ele1)
+    box2 = triangle_boxes(nodes2, ele2)
+
+    polys, counts, planes = [], [], []
+    for s in range(0, len(ele1), chunk):
+        i, j = box_pairs(box1[s:s + chunk], box2)
+        i = i + s
+        three = np.full(len(i), 3)
+        poly, count = clip_convex(nodes1[ele1[i]][:, :, :2], three,
+                                  nodes2[ele2[j]][:, :, :2], three)
+        keep = count >= 3
+        polys.append(pad(poly[keep], 6))
+        counts.append(count[keep])
+        planes.append((plane2[j] - plane1[i])[keep])
+    return np.concatenate(polys), np.concatenate(counts), np.concatenate(planes)
+
+
+def poly_values(poly, count, a, b, c):
+    # a * x + b * y + c at the vertices, min and max over every polygon
+    s = a[:, None] * poly[..., 0] + b[:, None] * poly[..., 1] + c[:, None]
+    valid = np.arange(poly.shape[1])[None, :] < count[:, None]
+    return np.where(valid, s, np.inf).min(axis = 1), np.where(valid, s, -np.inf).max(axis = 1)
+
+
+def split_by_line(poly, count, piece, x0, y0, x1, y1):
+    """Split the pieces crossed by the line through (x0, y0), (x1, y1)."""
+    n = len(poly)
+    a = np.full(n, -(y1 - y0))
+    b = np.full(n, x1 - x0)
+    c = -(a * x0 + b * y0)
+    smin, smax = poly_values(poly, count, a, b, c)
+    cross = (smin < 0) & (smax > 0)
+    if not cross.any():
+        return poly, count, piece
+    pos, npos = clip_halfplane(poly[cross], count[cross], a[cross], b[cross], c[cross])
+    neg, nneg = clip_halfplane(poly[cross], count[cross], -a[cross], -b[cross], -c[cross])
+    width = max(poly.shape[1], pos.shape[1], neg.shape[1])
+    keep = ~cross
+    return (np.concatenate([pad(poly[keep], width), pad(pos, width), pad(neg, width)]),
+            np.concatenate([count[keep], npos, nneg]),
+            np.concatenate([piece[keep], piece[cross], piece[cross]]))
+
+
+def inside(x, y, edges, chunk = 4000000):
+    """Even-odd point in polygon test for many points."""
+    res = np.zeros(len(x), dtype = bool)
+    step = max(1, chunk // max(len(edges), 1))
+    x0, y0, x1, y1 = [e[None, :] for e in edges.T]
+    for s in range(0, len(x), step):
+        px = x[s:s + step, None]
+        py = y[s:s + step, None]
+        cond = (y0 > py) != (y1 > py)
+        dy = np.where(cond, y1 - y0, 1.0)
+        xint = x0 + (py - y0) * (x1 - x0) / dy
+        res[s:s + step] = (cond & (px < xint)).sum(axis = 1) % 2 == 1
+    return res
+
+
+def zone_pieces(poly, count, rings):
+    """Pieces (cut along the zone boundary) inside a polygon zone."""
+    edges = np.concatenate([np.c_[r[:-1], r[1:]] for r in rings])
+    zmin = np.concatenate(rings).min(axis = 0)
+    zmax = np.concatenate(rings).max(axis = 0)
+
+    valid = np.arange(poly.shape[1])[None, :] < count[:, None]
+    px = np.where(valid, poly[..., 0], np.nan)
+    py = np.where(valid, poly[..., 1], np.nan)
+    bmin = np.c_[np.nanmin(px, axis = 1), np.nanmin(py, axis = 1)]
+    bmax = np.c_[np.nanmax(px, axis = 1), np.nanmax(py, axis = 1)]
+    sel = np.flatnonzero((bmin <= zmax).all(axis = 1) & (bmax >= zmin).all(axis = 1))
+    poly = poly[sel]
+    count = count[sel]
+    bmin = bmin[sel]
+    bmax = bmax[sel]
+    piece = np.arange(len(sel))
+
+    # cutting by the lines of the zone edges leaves every piece
+    # completely inside or outside of the zone
+    for x0, y0, x1, y1 in edges:
+        if x0 == x1 and y0 == y1:
+            continue
+        near = ((bmin[piece, 0] <= max(x0, x1)) & (bmax[piece, 0] >= min(x0, x1)) &
+                (bmin[piece, 1] <= max(y0, y1)) & (bmax[piece, 1] >= min(y0, y1)))
+        if not near.any():
+            continue
+        p, c, k = split_by_line(poly[near], count[near], piece[near], x0, y0, x1, y1)
+        width = max(poly.shape[1], p.shape[1])
+        poly = np.concatenate([pad(poly[~near], width), pad(p, width)])
+        count = np.concatenate([count[~near], c])
+        piece = np.concatenate([piece[~near], k])
+
+    keep = count >= 3
+    poly, count, piece = poly[keep], count[keep], piece[keep]
+    area, cx, cy = area_centroid(poly, count)
+    ins = inside(cx, cy, edges)
+    return poly[ins], count[ins], sel[piece[ins]]
+
+
+def cut_fill(poly, count, plane):
+    """Fill volume, cut volume, fill area and cut area of all pieces."""
+    a, b, c = plane.T
+    res = []
+    for sign in (1, -1):
+        p, n = clip_halfplane(poly, count, sign * a, sign * b, sign * c)
+        area, cx, cy = area_centroid(p, n)
+        vol = area * sign * (a * cx + b * cy + c)
+        vol = np.where(n >= 3, vol, 0)
+        res.append((vol.sum(), area[vol > 0].sum()))
+    (fill, fill_area), (cut, cut_area) = res
+    return fill, cut, fill_area, cut_area
+
+
+def read_zones(zones):
+    vmap = VectorTopo(zones)
+    vmap.open('r')
+    result = []
+    for area in vmap.viter('areas'):
+        if area.cat is None:
+            continue
+        rings = [area.points()] + [isle.points() for isle in area.isles()]
+        result.append((area.cat, [np.array(r.to_list())[:, :2] for r in rings]))
+    vmap.close()
+    return result
+
+
+def main():
+    in_before = options['before']
+    in_after = options['after']
+    zones = options['zones']
+
+    global nuldev
+    nuldev = None
+
+    # check if input maps are existed
+    for name in (in_before, in_after, zones):
+        if name and not grass.find_file(name, element = 'vector')['file']:
+            grass.fatal(_("<%s> does not exist.") % name)
+
+    ## initialize GRASS Ctypes library
+    G_gisinit('')
+    grass.message(_("Reading TINs..."))
+    tin1 = load_tin(in_before)
+    tin2 = load_tin(in_after)
+
+    grass.message(_("Overlaying TINs..."))
+    poly, count, plane = overlay(tin1, tin2)
+
+    results = []
+    if zones:
+        grass.message(_("Computing volumes per zone..."))
+        sums = {}
+        for cat, rings in read_zones(zones):
+            p, c, idx = zone_pieces(poly, count, rings)
+            vals = np.array(cut_fill(p, c, plane[idx]))
+            sums[cat] = sums.get(cat, 0) + vals
+        results = sorted(sums.items())
+    else:
+        results = [('total', np.array(cut_fill(poly, count, plane)))]
+
+    if flags['p'] or not zones:
+        sys.stdout.write("cat|fill_vol|cut_vol|fill_area|cut_area\n")
+        for cat, vals in results:
+            sys.stdout.write("%s|%s\n" % (cat, '|'.join('%.6f' % v for v in vals)))
+        return 0
+
+    ## upload to the zones table
+    try:
+        db = grass.vector_db(zones)[1]
+    except KeyError:
+        grass.run_command('v.db.addtable', map_ = zones, quiet = True, stderr = nuldev)
+        db = grass.vector_db(zones)[1]
+    cols = ('fill_vol', 'cut_vol', 'fill_area', 'cut_area')
+    existing = grass.vector_columns(zones)
+    new_cols = ['%s double precision' % col for col in cols if col not in existing]
+    if new_cols:
+        grass.run_command('v.db.addcolumn', map_ = zones, columns = ','.join(new_cols),
+                          quiet = True, stderr = nuldev)
+    sql = ['BEGIN TRANSACTION;']
+    for cat, vals in results:
+        sets = ', '.join('%s = %.6f' % (col, v) for col, v in zip(cols, vals))
+        sql.append("UPDATE %s SET %s WHERE %s = %d;" % (db['table'], sets, db['key'], cat))
+    sql.append('COMMIT;')
+    grass.write_command('db.execute', input_ = '-', database = db['database'],
+                        driver = db['driver'], stdin = '\n'.join(sql))
+
+    return 0
+
+
+if __name__ == "__main__":
+    options, flags = grass.parser()
+    sys.exit(main())
@@ -36,10 +36,10 @@
 #%Option
 #%  key: points
 #%  type: string
-#%  required: yes
+#%  required: no
 #%  multiple: no
 #%  key_desc: name
-#%  description: Input vector map containing points
+#%  description: Input vector map containing points (points to insert with <update>)
 #%  gisprompt: old,vector,vector
 #%End
 #%Option
@@ -54,13 +54,31 @@
 #%Option
 #%  key: tin
 #%  type: string
-#%  required: yes
+#%  required: no
 #%  multiple: no
 #%  key_desc: name
 #%  description: Name of output vector map (TIN)
 #%  gisprompt: new,vector,vector
 #%End
 #%Option
+#%  key: update
+#%  type: string
+#%  required: no
+#%  multiple: no
+#%  key_desc: name
+#%  description: Existing TIN map to update incrementally (inserts <points>, removes <remove>)
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
+#%  key: remove
+#%  type: string
+#%  required: no
+#%  multiple: no
+#%  key_desc: name
+#%  description: Input vector map containing points to remove from <update> TIN
+#%  gisprompt: old,vector,vector
+#%End
+#%Option
 #%  key: max_area
 #%  type: double
 #%  required: no
@@ -76,6 +94,29 @@
 #%  key_desc: name
 #%  description: Minimum mesh angle (use with "-q" flag)
 #%End
+#%Option
+#%  key: snap
+#%  type: double
+#%  required: no
+#%  multiple: no
+#%  description: Snapping tolerance to remove duplicate points (in map units)
+#%End
+#%Option
+#%  key: zmethod
+#%  type: string
+#%  required: no
+#%  multiple: no
+#%  options: min,max,mean
+#%  answer: mean
+#%  description: Method to choose z of the points merged by snapping or thinning
+#%End
+#%Option
+#%  key: density
+#%  type: double
+#%  required: no
+#%  multiple: no
+#%  description: Thin points to the target density (points per square map unit)
+#%End
 #%Flag
 #%  key: d 
 #%  description: Conforming Delaunay triangulation
@@ -88,6 +129,15 @@
 #%  key: a
 #%  description: Imposes a maximum triangle area constraint
 #%End
+#%Flag
+#%  key: f
+#%  description: Force triangulation (do not read triangulation cache)
+#%End
+###########################################################################
+#
+# REQUIREMENTS:
+#      - NumPy module
+#
 ###########################################################################
 
 import sys
@@ -95,9 +145,12 @@ import os
 import glob
 import atexit
 import csv
+import io
 import itertools
 import subprocess 
 
+import numpy as np
+
 try:
     import grass.script as grass
 except:
@@ -111,6 +164,14 @@ except:
 from grass.lib.gis    import *
 from grass.lib.vector import *
 from grass.lib.raster import *
+from grass.pygrass.vector import VectorTopo
+from grass.pygrass.vector.geometry import Point, Boundary, Centroid
+
+from masspoints import thin_points
+from tinarrays import (read_triangle, write_ascii, cache_key, arrays_key,
+                       load_cache, save_cache, link_map, load_tin)
+from tinedit import TinEditor
+from tinindex import TinIndex
             
 if not grass.find_program('triangle'):
     if not grass.find_program('triangle.exe'):
@@ -128,12 +189,120 @@ def cleanup():
     grass.run_command('g.remove', type_ = 'vect', pat = 'V_TRIANGLE_*', flags = 'f',
                       quiet = True, stderr = nuldev)
 
+def points_xyz(in_map):
+    out = tmp + '_xyz_' + in_map.split('@')[0]
+    grass.run_command('v.out.ascii', input_ = in_map, output = out,
+                      sep = ' ', quiet = True, stderr = nuldev)
+    return np.loadtxt(out, usecols = (0, 1, 2), ndmin = 2)
+
+
+def tri_edges(editor, tris):
+    edges = set()
+    for t in tris:
+        tri = editor.ele[t]
+        for j in range(3):
+            edges.add(tuple(sorted((tri[j], tri[(j + 1) % 3]))))
+    return edges
+
+
+def tin_update(tin_map, in_pts, in_remove, snap):
+    ## initialize GRASS Ctypes library
+    G_gisinit('')
+    nodes, ele, neigh = load_tin(tin_map)
+    editor = TinEditor(nodes, ele, neigh)
+
+    ## remove nodes matching the points within snapping tolerance
+    nremoved = 0
+    if in_remove:
+        tol = float(snap) if snap else 1e-6
+        cells = {}
+        for n, (x, y) in enumerate(nodes[:, :2]):
+            # skip duplicates kept in .node but in no triangle
+            if editor.node_tri[n] >= 0:
+                cells.setdefault((int(x // tol), int(y // tol)), []).append(n)
+        for x, y, z in points_xyz(in_remove):
+            i, j = int(x // tol), int(y // tol)
+            near = [(np.hypot(nodes[n, 0] - x, nodes[n, 1] - y), n)
+                    for di in (-1, 0, 1) for dj in (-1, 0, 1)
+                    for n in cells.get((i + di, j + dj), [])
+                    if editor.node_alive[n]]
+            near = [dn for dn in near if dn[0] <= tol]
+            if not near:
+                grass.warning(_("No TIN node at point %s,%s") % (x, y))
+            elif not editor.remove(min(near)[1]):
+                grass.warning(_("Node at %s,%s is on the TIN hull, not removed") % (x, y))
+            else:
+                nremoved += 1
+
+    ## insert new points
+    ninserted = 0
+    if in_pts:
+        for x, y, z in points_xyz(in_pts):
+            if editor.insert(x, y, z):
+                ninserted += 1
+            else:
+                grass.warning(_("Point %s,%s is outside of the TIN or duplicated, skipped") % (x, y))
+
+    grass.message(_("%d points removed, %d points inserted") % (nremoved, ninserted))
+
+    ## rewrite only the affected triangles
+    removed = editor.removed()
+    added = editor.added()
+    old_edges = tri_edges(editor, removed)
+    new_edges = tri_edges(editor, added)
+    grass.message(_("Rewriting %d triangles by %d new ones...") % (len(removed), len(added)))
+
+    report = grass.read_command('v.category', input_ = tin_map, option = 'report',
+                                flags = 'g', quiet = True, stderr = nuldev)
+    maxcat = 0
+    for line in report.splitlines():
+        rec = line.split()
+        if len(rec) == 5 and rec[1] == 'all':
+            maxcat = max(maxcat, int(rec[4]))
+
+    vmap = VectorTopo(tin_map)
+    vmap.open('rw')
+    ids = []
+    for a, b in old_edges - new_edges:
+        pa, pb = editor.nodes[a], editor.nodes[b]
+        tol = 1e-6 * np.hypot(pb[0] - pa[0], pb[1] - pa[1])
+        line = vmap.find['by_point'].geo(Point((pa[0] + pb[0]) / 2, (pa[1] + pb[1]) / 2),
+                                         maxdist = tol, type = 'boundary')
+        if line:
+            ids.append(line.id)
+    for tri in editor.triangle_coords(removed):
+        x, y = tri[:, :2].mean(axis = 0)
+        area = vmap.find['by_point'].area(Point(x, y))
+        centroid = area.centroid() if area else None
+        if centroid:
+            ids.append(centroid.id)
+    for i in ids:
+        vmap.delete(i)
+    for a, b in new_edges - old_edges:
+        vmap.write(Boundary(points = [editor.nodes[a], editor.nodes[b]]))
+    for k, tri in enumerate(editor.triangle_coords(added)):
+        x, y, z = tri.mean(axis = 0)
+        vmap.write(Centroid(x = x, y = y, z = z), cat = maxcat + k + 1)
+    vmap.close()
+
+    ## store the updated triangulation
+    nodes, ele, neigh = editor.arrays()
+    key = arrays_key(nodes, ele)
+    save_cache(key, nodes, ele, neigh)
+    link_map(tin_map, key)
+
+
 def main():
     in_pts = options['points']
     in_lines = options['lines']
     out_tin = options['tin']
     max_area = options['max_area']
     min_angle = options['min_angle']
+    snap = options['snap']
+    zmethod = options['zmethod']
+    density = options['density']
+    upd_tin = options['update']
+    in_remove = options['remove']
     
     global tmp, nuldev, grass_version
     nuldev = None
@@ -141,6 +310,17 @@ def main():
     # setup temporary files
     tmp = grass.tempfile()
 
+    # incremental update of the existing TIN
+    if upd_tin:
+        if grass.find_file(upd_tin, element = 'vector')['mapset'] != grass.gisenv()['MAPSET']:
+            grass.fatal(_("TIN map <%s> not found in the current mapset") % upd_tin)
+        if not in_pts and not in_remove:
+            grass.fatal(_("\n Use <points> and/or <remove> option with <update> option"))
+        tin_update(upd_tin, in_pts, in_remove, snap)
+        return 0
+    if not in_pts or not out_tin:
+        grass.fatal(_("\n Options <points> and <tin> are required"))
+
     # check for LatLong location
     if grass.locn_is_latlong() == True:
         grass.fatal("Module works only in locations with cartesian coordinate system")
@@ -159,6 +339,10 @@ def main():
         grass.fatal(_("\n Use <max_area> option with <\"-a\" flag>"))
     if min_angle and not flags['q']:
         grass.fatal(_("\n Use <min_angle> option with <\"-q\" flag>"))
+    if snap and float(snap) <= 0:
+        grass.fatal(_("\n Option <snap> must be positive"))
+    if density and float(density) <= 0:
+        grass.fatal(_("\n Option <density> must be positive"))
     # if in_lines:
     if flags['a']:
         if max_area:
@@ -187,11 +371,20 @@ def main():
                       sep = ' ', quiet = True, stderr = nuldev)
 
     tmp_pts_cut2 = tmp_pts_cut + '2'
-    with open(tmp_pts_cut,'r') as fin:
-        with open (tmp_pts_cut2,'w') as fout:
-            writer = csv.writer(fout, delimiter=' ')            
-            for row in csv.reader(fin, delimiter=' '):
-                writer.writerow(row[0:3])
+    if snap or density:
+        ## remove duplicates and thin masspoints
+        xyz = np.loadtxt(tmp_pts_cut, usecols = (0, 1, 2), ndmin = 2)
+        xyz, ndup, nthin = thin_points(xyz, tolerance = float(snap or 0),
+                                       density = float(density or 0),
+                                       method = zmethod)
+        grass.message(_("%d duplicate points removed, %d points removed by thinning") % (ndup, nthin))
+        np.savetxt(tmp_pts_cut2, xyz, fmt = '%.15g', delimiter = ' ')
+    else:
+        with open(tmp_pts_cut,'r') as fin:
+            with open (tmp_pts_cut2,'w') as fout:
+                writer = csv.writer(fout, delimiter=' ')            
+                for row in csv.reader(fin, delimiter=' '):
+                    writer.writerow(row[0:3])
 
     if in_lines:
         grass.run_command('v.split', input_ = in_lines, output = 'V_TRIANGLE_CUT_SEGM',
@@ -315,114 +508,37 @@ def main():
             outfile.write('0')
 
             
-    ## let's triangulate
-    grass.message(_("Triangulate..."))
+    ## let's triangulate (or take the triangulation from cache)
+    switches = [s for s in ['-Q', '-c', '-n', flag_a, flag_d, flag_q] if s]
     if in_lines:
-        subprocess.call(['triangle', '-Q', '-c', '-p', flag_a, flag_d, flag_q, tmp_poly], shell = False)
+        switches.insert(2, '-p')
+        tri_input = tmp_poly
+        key = cache_key([tmp_node, tmp_poly], switches)
     else:
-        subprocess.call(['triangle', '-Q', '-c', flag_a, flag_d, flag_q, tmp_node], shell = False)
-
-    ## back from Triangle to GRASS
-    grass.message(_("Back from Triangle to GRASS..."))
-    out_node = tmp + '.1.node'
-    out_node = out_node.replace('0.','')
-
-    out_ele = tmp + '.1.ele'
-    out_ele = out_ele.replace('0.','')
-
-    out_node2 = out_node + '2'
-    out_node3 = out_node + '3'
-    out_node4 = out_node + '4'
-    out_ele2 = out_ele + '2'
-    out_ele3 = out_ele + '3'
-
-    with open(out_node, 'r') as f:
-        data = f.read().splitlines(True)
-        with open(out_node2, 'w') as fout:
-            fout.writelines(data[1:])
-
-    with open(out_node2, 'r') as f:
-        data = f.read().splitlines(True)
-        with open(out_node3, 'w') as fout:
-            fout.writelines(data[:-1])
-
-    with open(out_node4, 'w') as fout:
-        with open(out_node3) as fin:
-            for line in fin:
-                line2 = " ".join(line.split())
-                fout.write(line2 + '\n')
-
-    ## head + tail
-    with open(out_ele, 'r') as f:
-        data = f.read().splitlines(True)
-        with open(out_ele2, 'w') as fout:
-            fout.writelines(data[1:])
-
-    with open(out_ele2, 'r') as f:
-        data = f.read().splitlines(True)
-        with open(out_ele3, 'w') as fout:
-            fout.writelines(data[:-1])        
-    ## head + tail    
-            
-    out_ele4 = out_ele + '4'
-    with open(out_ele4, 'w') as fout:
-        with open(out_ele3) as fin:
-            for line in fin:
-                line2 = " ".join(line.split())
-                fout.write(line2 + '\n')
-    
-    out_ele5 = out_ele + '5'
-    with open(out_ele4,'r') as fin:
-        with open (out_ele5,'w') as fout:
-            writer = csv.writer(fout, delimiter='\n')
-            for row in csv.reader(fin, delimiter=' '):
-                row2 = row[1:4]
-                ap = ''.join(row[1:2])
-                row2.append(ap)
-                writer.writerow(row2)
-
-    out_ele6 = out_ele + '6'
-    with open(out_ele5, 'r') as f1, open(out_node4, 'r') as f2, open(out_ele6, 'w') as fout:
-        list1 = f1.read().splitlines()
-        list2 = f2.read().splitlines()
-        for line1 in list1:
-            for line2 in list2:                
-                if line2.startswith(str(line1)):
-                    fout.write(line2 + '\n')
-                    break
-
-    out_ele7 = out_ele + '7'
-    with open(out_ele6,'r') as fin:
-        with open (out_ele7,'w') as fout:
-            writer = csv.writer(fout, delimiter=' ')
-            for row in csv.reader(fin, delimiter=' '):
-                row = row[1:4]
-                writer.writerow(row)
+        tri_input = tmp_node
+        key = cache_key([tmp_node], switches)
+
+    tin = None
+    if not flags['f']:
+        tin = load_cache(key)
+    if tin is not None:
+        grass.message(_("Triangulation found in cache..."))
+        nodes, ele, neigh = tin
+    else:
+        grass.message(_("Triangulate..."))
+        subprocess.call(['triangle'] + switches + [tri_input], shell = False)
+
+        ## back from Triangle to GRASS
+        grass.message(_("Back from Triangle to GRASS..."))
+        out_node = tmp + '.1.node'
+        out_node = out_node.replace('0.','')
+        nodes, ele, neigh = read_triangle(out_node[:-len('.node')])
+        save_cache(key, nodes, ele, neigh)
+
+    out_ele10 = tmp + '.tin'
+    write_ascii(nodes, ele, out_ele10)
 
-    out_ele8 = out_ele + '8'
-    with open(out_ele8, 'w') as fout, open(out_ele7, 'r') as fin:
-        fout.write('B 4\n')
-        for line in fin:
-            fout.write(line)
-
-    out_ele9 = out_ele + '9'
-    with open(out_ele9, 'w') as fout:
-        with open(out_ele8, 'r') as fin:
-            for lineno, line in enumerate(fin):
-                if lineno % 4 == 0:
-                    fout.write(line.rstrip() + '\nB 4\n')
-                else:
-                    fout.write(line.rstrip() + '\n')
-
-    out_ele10 = out_ele + '10'
-    with open(out_ele10, 'w') as fout, open(out_ele9, 'r') as fin:
-        lines = fin.readlines()
-        lines = lines[:-1]    
-        lines = lines[1:]
-        for line in lines:
-            fout.write(line)
 
-            
     ## import "raw" TIN into GRASS
     grass.run_command('v.in.ascii', flags = 'zn', input_ = out_ele10, output = 'V_TRIANGLE_TIN_RAW',
                       format_ = 'standard', sep = ' ', quiet = True, stderr = nuldev)
@@ -435,42 +551,15 @@ def main():
 
     ## compute 3D centroids of areas
     grass.message(_("Compute 3D centroids of areas..."))
-    ## initialize GRASS Ctypes library
-    G_gisinit('')    
-    # define map structure 
-    map_info = pointer(Map_info())    
-    # set vector topology to level 2 
-    Vect_set_open_level(2)
-    
-    # check if vector map exists
-    mapset = G_find_vector2(out_tin, "")
-    if not mapset:
-        grass.fatal("Vector map <%s> not found" % out_tin)
-        
-    # open the vector map
-    Vect_open_old(map_info, out_tin, mapset)
-    Vect_maptype_info(map_info, out_tin, mapset)
-    
-    # output ascii
-    asc = grass.read_command("v.out.ascii", input_ = out_tin,
-                             format_ = "standard", type_ = 'centroid')
-    result = asc.split("\n")
-    
+    # sample the triangulation at the centroids (one vectorized pass)
+    index = TinIndex(nodes, ele)
+    asc = grass.read_command("v.out.ascii", input_ = out_tin, format_ = "point",
+                             type_ = 'centroid', sep = ' ', quiet = True)
+    xy = np.loadtxt(io.StringIO(asc), usecols = (0, 1), ndmin = 2)
+    z = index.sample(xy[:, 0], xy[:, 1])
+
     out_xyz = tmp + '.xyz'
-    with open(out_xyz, 'w') as fout:
-        for line in result:            
-            if re.findall(r'^.[0-9]+\.',line):                
-                line2 = ' '.join(line.split())
-                x = line2.split(' ')[0]
-                y = line2.split(' ')[1]
-                dx = c_double(float(x))
-                dy = c_double(float(y))
-                z = c_double()
-                
-                Vect_tin_get_z(map_info, dx, dy, byref (z), None, None)
-                fout.write(str(dx.value) + ',' + str(dy.value) + ',' + str(z.value) + '\n')
-                
-    Vect_close(map_info)
+    np.savetxt(out_xyz, np.c_[xy, z], fmt = '%.15g', delimiter = ',')
     
     grass.run_command('v.in.ascii', flags = 'zn', input_ = out_xyz, output = 'V_TRIANGLE_TIN_CENT',
                       format_ = 'point', sep = ',', z = 3, quiet = True, stderr = nuldev)
@@ -481,6 +570,9 @@ def main():
     grass.run_command('v.edit', map_ = out_tin, bgmap = 'V_TRIANGLE_TIN_CENT2', tool = 'copy', 
                       type_ = 'centroid', ids = '0-99999999', quiet = True, stderr = nuldev)
 
+    ## remember the triangulation of the output TIN
+    link_map(out_tin, key)
+
     return 0
             
 